@@ -1,10 +1,19 @@
+import atexit
 import io
 import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
 from typing import Any
 
 import numpy as np
 import requests
 from PIL import Image
+from prometheus_client import CollectorRegistry, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 from pydantic import Field
 from typing_extensions import Literal
 
@@ -16,12 +25,270 @@ logger = logging.getLogger(__name__)
 DETECTOR_KEY = "metis"
 
 
+class CircuitBreaker:
+    # closed: every call goes to the sidecar. After `failures` consecutive failures (errors, or
+    # replies slower than the latency SLO) it opens and calls fail fast for `open_s`. Then one
+    # half-open probe at a time goes through: `probes` successes in a row close the breaker, a
+    # failure opens it again. A probe with no outcome after `probe_timeout_s` is given up.
+    def __init__(self, failures: int, open_s: float, probes: int, probe_timeout_s: float):
+        self.failure_threshold = max(1, failures)
+        self.open_s = open_s
+        self.probes = max(1, probes)
+        self.probe_timeout_s = probe_timeout_s
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open":
+                if now - self._opened_at < self.open_s:
+                    self.rejected += 1
+                    return False
+                self.state = "half_open"
+                self._probe_started = 0.0
+            if now - self._probe_started < self.probe_timeout_s:
+                self.rejected += 1
+                return False
+            self._probe_started = now
+            return True
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self.successes += 1
+                self.consecutive_failures = 0
+                if self.state == "half_open":
+                    self._probe_started = 0.0
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.probes:
+                        self.state = "closed"
+                        logger.info("metis circuit breaker closed: %s", self.stats())
+                return
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self.opened += 1
+                self._opened_at = time.monotonic()
+                self._probe_successes = 0
+                logger.warning(
+                    "metis circuit breaker opened for %.1fs: %s", self.open_s, self.stats()
+                )
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "opened": self.opened,
+        }
+
+
+class BreakerCollector:
+    # Read at scrape time. Frigate runs each detector in its own process, outside the registry behind
+    # Frigate's /api/metrics, so the breaker is served on the detector's own metrics_port.
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+
+    def collect(self):
+        stats = self.breaker.stats()
+        state = GaugeMetricFamily(
+            "metis_breaker_state", "Circuit breaker state (1 for the current one)", labels=["state"]
+        )
+        for name in ("closed", "half_open", "open"):
+            state.add_metric([name], 1.0 if stats["state"] == name else 0.0)
+        yield state
+        yield GaugeMetricFamily(
+            "metis_breaker_consecutive_failures",
+            "Failures since the last success",
+            value=stats["consecutive_failures"],
+        )
+        calls = CounterMetricFamily(
+            "metis_breaker_calls", "Detector calls by breaker outcome", labels=["result"]
+        )
+        calls.add_metric(["success"], stats["successes"])
+        calls.add_metric(["failure"], stats["failures"])
+        calls.add_metric(["rejected"], stats["rejected"])
+        yield calls
+        yield CounterMetricFamily(
+            "metis_breaker_opened", "Times the breaker opened", value=stats["opened"]
+        )
+
+
+# Must match the Unix-socket protocol in metis-detector/app.py.
+UDS_REQUEST = struct.Struct("<IBBHHHI")
+UDS_RESPONSE = struct.Struct("<IHHI")
+UDS_KIND_SHM_ATTACH = 3
+UDS_KIND_SHM = 4
+UDS_SLOT = struct.Struct("<I")
+DETECTION_ROW_BYTES = 24
+
+# Packed float32 [class_id, score, x1, y1, x2, y2] rows, offered by metis-detector next to JSON.
+DETECTIONS_CONTENT_TYPE = "application/x-safehaven-detections"
+ACCEPT = f"{DETECTIONS_CONTENT_TYPE}, application/json;q=0.5"
+
+
+class ShmClient:
+    # execution: shm. Tensors are copied into a ring of slots in a file next to metis-detector's
+    # Unix socket; the sidecar maps it read-only after an attach message, so a request is just
+    # a slot index and shape. Answers are packed float32 rows read straight into a reused buffer.
+    # Several slots keep a late answer to a timed-out request from racing the next frame.
+    def __init__(self, socket_path: str, slots: int, timeout: float, max_rows: int = 20):
+        self.socket_path = socket_path
+        self.slots = max(2, slots)
+        self.timeout = timeout
+        self.ring_path = os.path.join(
+            os.path.dirname(socket_path), f"frigate-metis-{os.getpid()}-{id(self):x}.ring"
+        )
+        self._rows = np.zeros((max_rows, 6), dtype="<f4")
+        self._rows_view = memoryview(self._rows).cast("B")
+        self._header = bytearray(UDS_RESPONSE.size)
+        self._sock: socket.socket | None = None
+        self._ring: mmap.mmap | None = None
+        self._slot_shape: tuple[int, ...] = ()
+        self._slot = 0
+        self._ids = 0
+        atexit.register(self.close)
+
+    def detect(self, frame: np.ndarray) -> np.ndarray:
+        shape = frame.shape if frame.ndim == 3 else (*frame.shape, 1)
+        if shape != self._slot_shape:
+            self._create_ring(shape)
+        if self._sock is None:
+            self._connect()
+
+        self._slot = (self._slot + 1) % self.slots
+        slot_bytes = int(np.prod(shape))
+        slot = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._ring, offset=self._slot * slot_bytes)
+        np.copyto(slot, frame)
+        h, w = frame.shape[:2]
+        try:
+            count = self._round_trip(
+                UDS_KIND_SHM, (h, w, frame.shape[2] if frame.ndim == 3 else 0), UDS_SLOT.pack(self._slot)
+            )
+        except (OSError, RuntimeError):
+            self._disconnect()
+            raise
+        return self._rows[:count]
+
+    def close(self) -> None:
+        self._disconnect()
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+        try:
+            os.unlink(self.ring_path)
+        except FileNotFoundError:
+            pass
+
+    def _create_ring(self, shape: tuple[int, ...]) -> None:
+        self._disconnect()
+        if self._ring is not None:
+            self._ring.close()
+        fd = os.open(self.ring_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, self.slots * int(np.prod(shape)))
+            self._ring = mmap.mmap(fd, self.slots * int(np.prod(shape)))
+        finally:
+            os.close(fd)
+        self._slot_shape = shape
+
+    def _connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        h, w, c = self._slot_shape
+        try:
+            self._round_trip(UDS_KIND_SHM_ATTACH, (h, w, c), self.ring_path.encode("utf-8"))
+        except (OSError, RuntimeError):
+            self._disconnect()
+            raise
+        logger.info("metis shm ring attached: socket=%s ring=%s", self.socket_path, self.ring_path)
+
+    def _disconnect(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _round_trip(self, kind: int, shape: tuple[int, int, int], payload: bytes) -> int:
+        self._ids = (self._ids + 1) & 0xFFFFFFFF
+        request_id = self._ids
+        self._sock.sendall(UDS_REQUEST.pack(request_id, kind, 0, *shape, len(payload)) + payload)
+        while True:
+            self._recv_into(memoryview(self._header))
+            answer_id, status, _retry_after, length = UDS_RESPONSE.unpack(self._header)
+            if answer_id != request_id or status != 200:
+                body = self._recv_bytes(length)
+                if answer_id != request_id:
+                    continue
+                raise RuntimeError(f"metis-detector returned {status}: {body.decode('utf-8', 'replace')}")
+            count = min(length // DETECTION_ROW_BYTES, len(self._rows))
+            self._recv_into(self._rows_view[: count * DETECTION_ROW_BYTES])
+            self._recv_bytes(length - count * DETECTION_ROW_BYTES)
+            return count
+
+    def _recv_into(self, view: memoryview) -> None:
+        received = 0
+        while received < len(view):
+            count = self._sock.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError("metis-detector closed the socket")
+            received += count
+
+    def _recv_bytes(self, size: int) -> bytes:
+        buf = bytearray(size)
+        self._recv_into(memoryview(buf))
+        return bytes(buf)
+
+
 class MetisDetectorConfig(BaseDetectorConfig):
     type: Literal[DETECTOR_KEY]
     endpoint: str = Field(
         default="http://metis-detector:8090/detect", title="Metis HTTP endpoint"
     )
     timeout_ms: int = Field(default=200, title="HTTP timeout in milliseconds")
+    execution: Literal["http", "shm"] = Field(
+        default="http", title="http: JPEG over HTTP; shm: raw tensors over a shared-memory ring"
+    )
+    socket_path: str = Field(
+        default="/run/metis/metis.sock", title="metis-detector Unix socket (execution: shm)"
+    )
+    shm_slots: int = Field(default=4, title="Slots in the shared-memory ring (execution: shm)")
+    breaker_failures: int = Field(
+        default=5, title="Consecutive failures or SLO breaches that open the circuit breaker"
+    )
+    breaker_slo_ms: int = Field(
+        default=0, title="Latency SLO in milliseconds; slower replies count as failures (0 disables)"
+    )
+    breaker_open_ms: int = Field(
+        default=5000, title="How long the open breaker fails fast before a half-open probe"
+    )
+    breaker_probes: int = Field(
+        default=1, title="Successful half-open probes needed to close the breaker"
+    )
+    metrics_port: int = Field(
+        default=0, title="Serve circuit breaker metrics for Prometheus on this port (0 disables)"
+    )
 
 
 class MetisDetector(DetectionApi):
@@ -34,16 +301,34 @@ class MetisDetector(DetectionApi):
         self.timeout = detector_config.timeout_ms / 1000.0
         self.session = requests.Session()
         self._zero_result = np.zeros((20, 6), np.float32)
+        self._result = np.zeros((20, 6), np.float32)
+        self.shm = None
+        if detector_config.execution == "shm":
+            self.shm = ShmClient(detector_config.socket_path, detector_config.shm_slots, self.timeout)
+        self.slo = detector_config.breaker_slo_ms / 1000.0
+        self.breaker = CircuitBreaker(
+            failures=detector_config.breaker_failures,
+            open_s=detector_config.breaker_open_ms / 1000.0,
+            probes=detector_config.breaker_probes,
+            probe_timeout_s=max(1.0, 2 * self.timeout),
+        )
+        if detector_config.metrics_port:
+            registry = CollectorRegistry()
+            registry.register(BreakerCollector(self.breaker))
+            try:
+                start_http_server(detector_config.metrics_port, registry=registry)
+            except OSError as exc:
+                logger.warning(
+                    "metis breaker metrics unavailable on port %s: %s", detector_config.metrics_port, exc
+                )
 
-    def _encode_jpeg(self, tensor_input: np.ndarray) -> bytes | None:
+    def _frame(self, tensor_input: np.ndarray) -> np.ndarray:
         frame = np.squeeze(tensor_input)
 
         # Frigate can pass CHW or HWC. Normalize to HWC for encoding.
         if frame.ndim == 3 and frame.shape[0] in (1, 3, 4) and frame.shape[0] < frame.shape[-1]:
             frame = np.transpose(frame, (1, 2, 0))
 
-        frame = np.ascontiguousarray(frame)
-
         if frame.dtype != np.uint8:
             frame = np.clip(frame, 0, 255).astype(np.uint8)
 
@@ -52,9 +337,11 @@ class MetisDetector(DetectionApi):
             frame = frame[:, :, 0]
         elif frame.ndim == 3 and frame.shape[2] == 4:
             frame = frame[:, :, :3]
+        return frame
 
+    def _encode_jpeg(self, tensor_input: np.ndarray) -> bytes | None:
         try:
-            image = Image.fromarray(frame)
+            image = Image.fromarray(np.ascontiguousarray(self._frame(tensor_input)))
             with io.BytesIO() as output:
                 image.save(output, format="JPEG")
                 return output.getvalue()
@@ -66,59 +353,83 @@ class MetisDetector(DetectionApi):
         # Metis service contract: [class_id, score, x1, y1, x2, y2] normalized.
         if not isinstance(value, list) or len(value) < 6:
             return None
-
         try:
-            class_id = float(value[0])
-            score = float(value[1])
-            x1 = float(value[2])
-            y1 = float(value[3])
-            x2 = float(value[4])
-            y2 = float(value[5])
+            return [float(field) for field in value[:6]]
         except (TypeError, ValueError):
             return None
 
-        x1 = max(0.0, min(1.0, x1))
-        y1 = max(0.0, min(1.0, y1))
-        x2 = max(0.0, min(1.0, x2))
-        y2 = max(0.0, min(1.0, y2))
+    def _parse_rows(self, response: requests.Response) -> np.ndarray | None:
+        if response.headers.get("content-type", "").startswith(DETECTIONS_CONTENT_TYPE):
+            content = response.content
+            return np.frombuffer(content, dtype="<f4", count=len(content) // 4 // 6 * 6).reshape(-1, 6)
 
-        # Frigate contract: [label, score, y_min, x_min, y_max, x_max]
-        return [class_id, score, y1, x1, y2, x2]
+        payload = response.json()
+        if not isinstance(payload, list):
+            return None
+        # Well-formed replies convert in one call; otherwise malformed items are dropped one by one.
+        try:
+            rows = np.asarray(payload[:20], dtype=np.float32)
+        except (TypeError, ValueError):
+            rows = None
+        if rows is None or rows.ndim != 2 or rows.shape[1] < 6:
+            parsed = [row for row in map(self._parse_detection, payload) if row is not None]
+            rows = np.asarray(parsed[:20], dtype=np.float32).reshape(-1, 6)
+        return rows[:, :6]
+
+    def _write_result(self, rows: np.ndarray) -> np.ndarray:
+        # Frigate contract: [label, score, y_min, x_min, y_max, x_max], written into a reused buffer.
+        rows = rows[:20]
+        count = len(rows)
+        result = self._result
+        result[count:] = 0.0
+        result[:count, :2] = rows[:, :2]
+        np.clip(rows[:, [3, 2, 5, 4]], 0.0, 1.0, out=result[:count, 2:])
+        return result
 
     def detect_raw(self, tensor_input: np.ndarray) -> np.ndarray:
+        # While the breaker is open a frame costs a lock check instead of timeout_ms.
+        if not self.breaker.allow():
+            return self._zero_result
+        if self.shm is not None:
+            return self._detect_shm(tensor_input)
+
         jpeg_bytes = self._encode_jpeg(tensor_input)
         if jpeg_bytes is None:
+            # Counted as a failure so a half-open probe that never reached the sidecar is settled.
+            self.breaker.record(False)
             return self._zero_result
 
+        started = time.monotonic()
         try:
             response = self.session.post(
                 self.endpoint,
                 data=jpeg_bytes,
-                headers={"Content-Type": "image/jpeg"},
+                headers={"Content-Type": "image/jpeg", "Accept": ACCEPT},
                 timeout=self.timeout,
             )
             response.raise_for_status()
-            payload = response.json()
+            rows = self._parse_rows(response)
         except requests.exceptions.RequestException as exc:
+            self.breaker.record(False)
             logger.debug("metis request failed: %s", exc)
             return self._zero_result
         except ValueError:
+            self.breaker.record(False)
             logger.debug("metis response is not valid JSON")
             return self._zero_result
+        self.breaker.record(not self.slo or time.monotonic() - started <= self.slo)
 
-        if not isinstance(payload, list):
+        if rows is None:
             return self._zero_result
+        return self._write_result(rows)
 
-        detections = np.zeros((20, 6), np.float32)
-        write_idx = 0
-
-        for item in payload:
-            parsed = self._parse_detection(item)
-            if parsed is None:
-                continue
-            detections[write_idx] = parsed
-            write_idx += 1
-            if write_idx == 20:
-                break
-
-        return detections
+    def _detect_shm(self, tensor_input: np.ndarray) -> np.ndarray:
+        started = time.monotonic()
+        try:
+            rows = self.shm.detect(self._frame(tensor_input))
+        except (OSError, RuntimeError, ValueError) as exc:
+            self.breaker.record(False)
+            logger.debug("metis shm request failed: %s", exc)
+            return self._zero_result
+        self.breaker.record(not self.slo or time.monotonic() - started <= self.slo)
+        return self._write_result(rows)
@@ -1,33 +1,198 @@
+import asyncio
 import datetime
+import hashlib
 import io
 import json
 import logging
+import math
+import mmap
 import os
+import queue
+import struct
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from threading import Lock
-from typing import List
+from threading import Lock, Thread
+from typing import Any, Dict, List, Optional, Tuple, Union
 import sys
 
 import numpy as np
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from PIL import Image
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 
 try:
     from ultralytics import YOLO
 except Exception:  # pragma: no cover
     YOLO = None
 
+try:
+    import onnxruntime as ort
+except Exception:  # pragma: no cover
+    ort = None
+
 app = FastAPI(title="metis-detector", version="0.1.0")
-_model_lock = Lock()
-_model = None
 LOGGER = logging.getLogger("metis-detector")
+TENSOR_CONTENT_TYPE = "application/x-safehaven-tensor"
+# Binary response: packed little-endian float32 rows [class_id, score, x1, y1, x2, y2].
+DETECTIONS_CONTENT_TYPE = "application/x-safehaven-detections"
+
+# Detections travel as (N, 6) float32 arrays and only become JSON at the response.
+Detections = np.ndarray
+_NO_DETECTIONS = np.zeros((0, 6), dtype=np.float32)
+
+# Unix-socket protocol, little endian. Request: id, kind, flags, h, w, c, payload_len + payload.
+# Response: id, status (HTTP code), retry_after_s, payload_len + payload, where a 200 payload
+# is N*6 packed float32 [class_id, score, x1, y1, x2, y2] and any other status carries a message.
+UDS_REQUEST = struct.Struct("<IBBHHHI")
+UDS_RESPONSE = struct.Struct("<IHHI")
+UDS_KIND_JPEG = 1
+UDS_KIND_TENSOR = 2
+# Shared-memory ring: SHM_ATTACH names a ring file in the socket's directory (payload: its path)
+# made of slots of h*w*c bytes, and SHM requests then carry only a <I slot index while h, w, c give
+# the shape of the tensor in that slot.
+UDS_KIND_SHM_ATTACH = 3
+UDS_KIND_SHM = 4
+UDS_SLOT = struct.Struct("<I")
+UDS_FLAG_BGR = 1
+# The payload starts with the letterbox (x0, y0, x1, y1) as four float32 fractions.
+UDS_FLAG_LETTERBOX = 2
+# Skip the result cache lookup (the fresh result still replaces the cached one).
+UDS_FLAG_NO_CACHE = 4
+UDS_LETTERBOX = struct.Struct("<4f")
+UDS_MAX_PAYLOAD = 32 * 1024 * 1024
+_uds_server = None
+
+BATCH_SIZE = Histogram(
+    "metis_batch_size",
+    "Images per batched model.predict call",
+    ["model"],
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+)
+QUEUE_WAIT_MS = Histogram(
+    "metis_queue_wait_ms",
+    "Time a request waited for its micro-batch to start, in milliseconds",
+    ["model"],
+    buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+PREDICT_MS = Histogram(
+    "metis_predict_ms",
+    "model.predict time per micro-batch, in milliseconds",
+    ["model"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+QUEUE_DEPTH = Gauge("metis_queue_depth", "Images admitted and not yet answered")
+MODEL_QUEUE_DEPTH = Gauge("metis_model_queue_depth", "Images admitted for a model and not yet answered", ["model"])
+REJECTED = Counter("metis_rejected_requests", "Requests rejected because the inference queue was full")
+RESULT_CACHE = Counter("metis_result_cache", "Result cache lookups per image", ["result"])
+RESULT_CACHE_EVICTIONS = Counter("metis_result_cache_evictions", "Result cache entries dropped", ["reason"])
+RESULT_CACHE_ENTRIES = Gauge("metis_result_cache_entries", "Results held in the result cache")
+RESULT_CACHE_BYTES = Gauge("metis_result_cache_bytes", "Estimated size of the results held in the result cache")
 
 
 class Config:
     mock = os.getenv("MOCK", "0") == "1"
     model_dir = os.getenv("MODEL_DIR", "")
+    default_model = os.getenv("DEFAULT_MODEL", "")
+    warmup_size = int(os.getenv("WARMUP_SIZE", "640"))
+    jpeg_draft = os.getenv("JPEG_DRAFT", "1") == "1"
+    backend = os.getenv("BACKEND", "auto").lower()
+    conf_threshold = float(os.getenv("CONF_THRESHOLD", "0.25"))
+    iou_threshold = float(os.getenv("IOU_THRESHOLD", "0.7"))
+    max_detections = int(os.getenv("MAX_DETECTIONS", "300"))
+    ort_intra_op_threads = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+    ort_inter_op_threads = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+    ort_input_size = int(os.getenv("ORT_INPUT_SIZE", "640"))
+    ort_quantize = os.getenv("ORT_QUANTIZE", "off").lower()
     log_format = os.getenv("LOG_FORMAT", "text")
     log_level = os.getenv("LOG_LEVEL", "INFO")
+    max_batch_items = int(os.getenv("MAX_BATCH_ITEMS", "16"))
+    batch_window_ms = float(os.getenv("BATCH_WINDOW_MS", "3"))
+    max_batch_size = int(os.getenv("MAX_BATCH_SIZE", "8"))
+    infer_workers = int(os.getenv("INFER_WORKERS", "1"))
+    decode_workers = int(os.getenv("DECODE_WORKERS", str(os.cpu_count() or 2)))
+    max_pending = int(os.getenv("MAX_PENDING", "64"))
+    retry_after_s = os.getenv("RETRY_AFTER_S", "1")
+    uds_path = os.getenv("UDS_PATH", "")
+    result_cache_entries = int(os.getenv("RESULT_CACHE_ENTRIES", "1024"))
+    result_cache_bytes = int(os.getenv("RESULT_CACHE_BYTES", str(8 * 1024 * 1024)))
+    result_cache_ttl_s = float(os.getenv("RESULT_CACHE_TTL_S", "10"))
+
+
+class AdmissionQueue:
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self.depth = 0
+        self._lock = Lock()
+
+    def try_acquire(self, count: int) -> bool:
+        with self._lock:
+            # An idle detector always admits, so a batch larger than the limit is not starved.
+            if self.depth and self.depth + count > self.limit:
+                return False
+            self.depth += count
+            return True
+
+    def release(self, count: int) -> None:
+        with self._lock:
+            self.depth -= count
+
+
+class ResultCache:
+    # LRU of detections keyed by a hash of the model and the exact image bytes, so identical
+    # images (retries, the plugin and core watching the same static scene, duplicate zones) skip
+    # the model. Entries live at most ttl_s. An entry's size is its key plus the packed detections.
+    def __init__(self, max_entries: int, max_bytes: int, ttl_s: float) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.enabled = max_entries > 0 and max_bytes > 0 and ttl_s > 0
+        self.bytes = 0
+        self._entries: "OrderedDict[bytes, Tuple[float, int, Detections]]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: bytes) -> Optional[Detections]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, _size, detections = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                RESULT_CACHE_EVICTIONS.labels(reason="expired").inc()
+                return None
+            self._entries.move_to_end(key)
+            return detections
+
+    def put(self, key: bytes, detections: Detections) -> None:
+        size = len(key) + detections.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_s, size, detections)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                RESULT_CACHE_EVICTIONS.labels(reason="capacity").inc()
+
+    def _remove(self, key: bytes) -> None:
+        self.bytes -= self._entries.pop(key)[1]
+
+
+_admission = AdmissionQueue(Config.max_pending)
+_result_cache = ResultCache(Config.result_cache_entries, Config.result_cache_bytes, Config.result_cache_ttl_s)
+_decode_pool = ThreadPoolExecutor(max_workers=max(1, Config.decode_workers), thread_name_prefix="decode")
+QUEUE_DEPTH.set_function(lambda: _admission.depth)
+RESULT_CACHE_ENTRIES.set_function(lambda: len(_result_cache))
+RESULT_CACHE_BYTES.set_function(lambda: _result_cache.bytes)
 
 
 class JsonFormatter(logging.Formatter):
@@ -56,38 +221,37 @@ def _setup_logging() -> None:
     root.setLevel(level)
 
 
-def _resolve_model_path(model_dir: str) -> str:
+def _discover_models(model_dir: str, patterns: Tuple[str, ...] = ("*.pt", "*.onnx")) -> Dict[str, str]:
+    # Model ids are file stems; a MODEL_DIR pointing at a single file serves just that model.
     path = Path(model_dir)
     if path.is_file():
-        return str(path)
+        return {path.stem: str(path)}
+    models: Dict[str, str] = {}
     if path.is_dir():
-        candidates = list(path.glob("*.pt")) + list(path.glob("*.onnx"))
-        if candidates:
-            return str(candidates[0])
-    raise FileNotFoundError(f"No YOLO model found under MODEL_DIR={model_dir}")
-
-
-def _get_model():
-    global _model
-    if _model is not None:
-        return _model
-    if YOLO is None:
-        raise RuntimeError("ultralytics is not available")
-    with _model_lock:
-        if _model is None:
-            model_path = _resolve_model_path(Config.model_dir)
-            _model = YOLO(model_path)
-    return _model
+        for candidate in (found for pattern in patterns for found in sorted(path.glob(pattern))):
+            models.setdefault(candidate.stem, str(candidate))
+    if not models:
+        raise FileNotFoundError(f"No YOLO model found under MODEL_DIR={model_dir}")
+    return models
 
 
-def _mock_detection() -> List[List[float]]:
-    return [[0, 0.95, 0.2, 0.2, 0.8, 0.8]]
+def _mock_detection() -> Detections:
+    return np.array([[0, 0.95, 0.2, 0.2, 0.8, 0.8]], dtype=np.float32)
 
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     _setup_logging()
     LOGGER.info("metis-detector startup mock=%s model_dir=%s", Config.mock, Config.model_dir)
+    if not Config.mock:
+        _registry.start()
+    if Config.uds_path:
+        await _start_uds_server(Config.uds_path)
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/healthz")
@@ -99,53 +263,777 @@ def healthz():
 def readyz():
     if Config.mock:
         return {"ready": True, "mode": "mock"}
+    # Ready once the default model serves; other models may still be loading, and failed ones are
+    # listed rather than holding the whole service unready.
+    states = _registry.states()
+    failed = [model_id for model_id, state in states.items() if state == "failed"]
+    if _registry.error or states.get(_registry.default_id) != "ready":
+        raise HTTPException(status_code=503, detail={"models": states, "failed": failed, "error": _registry.error})
+    return {
+        "ready": True,
+        "mode": "inference",
+        "default_model": _registry.default_id,
+        "models": states,
+        "failed": failed,
+    }
+
+
+def _decode_jpeg(body: bytes, target: int = 0) -> np.ndarray:
     try:
-        _get_model()
-        return {"ready": True, "mode": "inference"}
-    except Exception as exc:
-        LOGGER.warning("readyz failed err=%s", exc)
-        raise HTTPException(status_code=503, detail=f"Model not ready: {exc}")
+        pil = Image.open(io.BytesIO(body))
+        if target and Config.jpeg_draft:
+            w, h = pil.size
+            scale = target / max(w, h)
+            if scale < 1.0:
+                # Decode at 1/2, 1/4 or 1/8 scale in the DCT domain, keeping the long side at or
+                # above the model input so the model's own resize still only shrinks.
+                pil.draft("RGB", (math.ceil(w * scale), math.ceil(h * scale)))
+        return np.array(pil.convert("RGB"))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JPEG payload")
 
 
-@app.post("/detect")
-async def detect(request: Request):
+@dataclass
+class TensorPayload:
+    data: memoryview
+    shape: Tuple[int, ...]
+    order: str
+
+
+def _decode_tensor(payload: TensorPayload) -> np.ndarray:
+    image = np.frombuffer(payload.data, dtype=np.uint8).reshape(payload.shape)
+    if image.ndim == 2:
+        image = np.repeat(image[:, :, None], 3, axis=2)
+    if payload.order == "bgr":
+        image = image[:, :, ::-1]
+    return image
+
+
+def _decode_payload(payload: Union[bytes, TensorPayload], target: int = 0) -> np.ndarray:
+    if isinstance(payload, TensorPayload):
+        return _decode_tensor(payload)
+    return _decode_jpeg(payload, target)
+
+
+def _nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float, limit: int) -> np.ndarray:
+    # Greedy NMS over xyxy boxes; each round suppresses every remaining box overlapping the best one.
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size and len(keep) < limit:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        inter = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None) * np.clip(
+            np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None
+        )
+        iou = inter / (areas[best] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+class UltralyticsBackend:
+    name = "ultralytics"
+
+    def __init__(self, path: str) -> None:
+        if YOLO is None:
+            raise RuntimeError("ultralytics is not available")
+        self.model = YOLO(path)
+        imgsz = getattr(self.model, "overrides", {}).get("imgsz") or 640
+        self.input_size = int(max(imgsz)) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+    def predict(self, images: List[np.ndarray]) -> List[Detections]:
+        results = self.model.predict(
+            images,
+            verbose=False,
+            conf=Config.conf_threshold,
+            iou=Config.iou_threshold,
+            max_det=Config.max_detections,
+        )
+        outputs: List[Detections] = [_NO_DETECTIONS] * len(images)
+        for idx, result in enumerate(results or []):
+            boxes = result.boxes
+            if boxes is None or not len(boxes):
+                continue
+            outputs[idx] = np.column_stack(
+                [
+                    boxes.cls.cpu().numpy(),
+                    boxes.conf.cpu().numpy(),
+                    np.clip(boxes.xyxyn.cpu().numpy(), 0.0, 1.0),
+                ]
+            ).astype(np.float32)
+        return outputs
+
+
+class OnnxRuntimeBackend:
+    # CPU inference without torch, for hosts without the accelerator. Expects an ultralytics
+    # detection export: input (N, 3, H, W) RGB scaled to [0, 1], output (N, 4 + classes, anchors)
+    # holding cx, cy, w, h in input pixels and one score per class. Images are letterboxed into
+    # one batch array; thresholds, class-aware NMS and box rescaling run vectorised in numpy.
+    name = "onnxruntime"
+    max_candidates = 30000
+
+    def __init__(self, path: str) -> None:
+        if ort is None:
+            raise RuntimeError("onnxruntime is not available")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = max(0, Config.ort_intra_op_threads)
+        options.inter_op_num_threads = max(0, Config.ort_inter_op_threads)
+        if Config.ort_inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        if Config.ort_quantize == "dynamic":
+            path = _quantize_dynamic(path)
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_dtype = np.float16 if model_input.type == "tensor(float16)" else np.float32
+        batch, _channels, height, width = model_input.shape
+        # Symbolic dimensions come back as strings: dynamic batch or input size.
+        self.fixed_batch = batch if isinstance(batch, int) else 0
+        self.height = height if isinstance(height, int) else Config.ort_input_size
+        self.width = width if isinstance(width, int) else Config.ort_input_size
+        self.input_size = max(self.width, self.height)
+
+    def predict(self, images: List[np.ndarray]) -> List[Detections]:
+        batch = np.full((len(images), self.height, self.width, 3), 114, dtype=np.uint8)
+        geometry = []
+        for idx, image in enumerate(images):
+            h, w = image.shape[:2]
+            scale = min(self.width / w, self.height / h)
+            new_w, new_h = max(1, round(w * scale)), max(1, round(h * scale))
+            x, y = (self.width - new_w) // 2, (self.height - new_h) // 2
+            if (new_w, new_h) != (w, h):
+                image = np.asarray(Image.fromarray(image).resize((new_w, new_h), Image.BILINEAR))
+            batch[idx, y:y + new_h, x:x + new_w] = image
+            geometry.append((scale, x, y, w, h))
+        blob = batch.transpose(0, 3, 1, 2).astype(self.input_dtype) / self.input_dtype(255.0)
+
+        step = self.fixed_batch or len(images)
+        predictions = []
+        for start in range(0, len(images), step):
+            chunk = blob[start:start + step]
+            count = len(chunk)
+            if len(chunk) < step:
+                chunk = np.concatenate([chunk, np.zeros((step - count, *chunk.shape[1:]), dtype=chunk.dtype)])
+            predictions.append(self.session.run(None, {self.input_name: np.ascontiguousarray(chunk)})[0][:count])
+        output = np.concatenate(predictions).astype(np.float32)
+        return [self._detections(prediction, *geo) for prediction, geo in zip(output, geometry)]
+
+    def _detections(self, prediction: np.ndarray, scale: float, pad_x: int, pad_y: int, w: int, h: int) -> Detections:
+        rows = prediction.T
+        class_scores = rows[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(rows)), class_ids]
+        mask = scores >= Config.conf_threshold
+        if not mask.any():
+            return _NO_DETECTIONS
+        rows, class_ids, scores = rows[mask], class_ids[mask], scores[mask]
+        if len(scores) > self.max_candidates:
+            top = np.argpartition(-scores, self.max_candidates)[:self.max_candidates]
+            rows, class_ids, scores = rows[top], class_ids[top], scores[top]
+
+        half = rows[:, 2:4] / 2.0
+        boxes = np.concatenate([rows[:, 0:2] - half, rows[:, 0:2] + half], axis=1)
+        # Offsetting boxes by class id keeps NMS from suppressing overlaps across classes.
+        offsets = class_ids[:, None].astype(np.float32) * float(max(self.width, self.height) + 1)
+        keep = _nms(boxes + offsets, scores, Config.iou_threshold, max(1, Config.max_detections))
+
+        boxes = (boxes[keep] - np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)) / scale
+        boxes = np.clip(boxes / np.array([w, h, w, h], dtype=np.float32), 0.0, 1.0)
+        # Boxes lying entirely in the letterbox padding clip to zero width or height.
+        inside = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+        return np.column_stack([class_ids[keep], scores[keep], boxes])[inside].astype(np.float32)
+
+
+def _quantize_dynamic(path: str) -> str:
+    # INT8 weights for a float model, written to the temp dir and reused while the source is unchanged.
+    # Pre-quantized (QDQ) exports need none of this and load like any other .onnx.
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source = Path(path)
+    target = Path(tempfile.gettempdir()) / f"{source.stem}.int8.onnx"
+    if not target.exists() or target.stat().st_mtime < source.stat().st_mtime:
+        LOGGER.info("quantizing model path=%s target=%s", source, target)
+        quantize_dynamic(str(source), str(target), weight_type=QuantType.QUInt8)
+    return str(target)
+
+
+def _create_backend(path: str):
+    # auto: ultralytics when it is installed (the accelerator path), onnxruntime on CPU otherwise.
+    backend = Config.backend
+    if backend == "auto":
+        backend = "onnxruntime" if YOLO is None and path.endswith(".onnx") else "ultralytics"
+    if backend == "onnxruntime":
+        return OnnxRuntimeBackend(path)
+    if backend == "ultralytics":
+        return UltralyticsBackend(path)
+    raise ValueError(f"Unknown BACKEND={Config.backend}")
+
+
+@dataclass
+class _PendingBatch:
+    images: List[np.ndarray]
+    future: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+def _gather_futures(futures: List[Future]) -> Future:
+    # One future for the concatenated results of several, failing with the first error.
+    if len(futures) == 1:
+        return futures[0]
+    combined: Future = Future()
+    remaining = [len(futures)]
+    lock = Lock()
+
+    def done(_future: Future) -> None:
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            combined.set_exception(errors[0])
+        else:
+            combined.set_result([output for future in futures for output in future.result()])
+
+    for future in futures:
+        future.add_done_callback(done)
+    return combined
+
+
+class MicroBatcher:
+    # Requests arriving within window_ms of the first queued one (or until max_batch
+    # images are collected) share one predict call; results are routed back per caller.
+    # No predict call exceeds max_batch: larger requests are split, and a request that
+    # would overflow the batch being collected starts the worker's next one instead.
+    def __init__(self, model_id: str, run_batch, window_ms: float, max_batch: int, workers: int = 1) -> None:
+        self.model_id = model_id
+        self._run_batch = run_batch
+        self._window = max(0.0, window_ms) / 1000.0
+        self._max_batch = max(1, max_batch)
+        self._queue: "queue.Queue[_PendingBatch]" = queue.Queue()
+        for idx in range(max(1, workers)):
+            Thread(target=self._loop, daemon=True, name=f"infer-{model_id}-{idx}").start()
+
+    def submit(self, images: List[np.ndarray]) -> Future:
+        chunks = [
+            _PendingBatch(images=images[start:start + self._max_batch])
+            for start in range(0, max(1, len(images)), self._max_batch)
+        ]
+        for pending in chunks:
+            self._queue.put(pending)
+        return _gather_futures([pending.future for pending in chunks])
+
+    def _collect(self, carry: Optional[_PendingBatch]) -> Tuple[List[_PendingBatch], Optional[_PendingBatch]]:
+        first = carry or self._queue.get()
+        batch = [first]
+        count = len(first.images)
+        deadline = first.enqueued + self._window
+        while count < self._max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if count + len(item.images) > self._max_batch:
+                return batch, item
+            batch.append(item)
+            count += len(item.images)
+        return batch, None
+
+    def _loop(self) -> None:
+        carry = None
+        while True:
+            batch, carry = self._collect(carry)
+            started = time.monotonic()
+            images = []
+            for item in batch:
+                QUEUE_WAIT_MS.labels(model=self.model_id).observe((started - item.enqueued) * 1000.0)
+                images.extend(item.images)
+            BATCH_SIZE.labels(model=self.model_id).observe(len(images))
+            try:
+                outputs = self._run_batch(images)
+            except Exception as exc:  # noqa: BLE001
+                for item in batch:
+                    item.future.set_exception(exc)
+                continue
+            PREDICT_MS.labels(model=self.model_id).observe((time.monotonic() - started) * 1000.0)
+            offset = 0
+            for item in batch:
+                item.future.set_result(outputs[offset:offset + len(item.images)])
+                offset += len(item.images)
+
+
+@dataclass
+class ModelEntry:
+    model_id: str
+    path: str
+    state: str = "pending"
+    backend: Any = None
+    batcher: Optional[MicroBatcher] = None
+    pending: int = 0
+
+
+class ModelRegistry:
+    # Every model under MODEL_DIR is loaded and warmed up at startup, one after the other, on a
+    # background thread so /healthz answers meanwhile. Each model gets its own micro-batcher,
+    # since only images for the same model can share a predict call.
+    def __init__(self, model_dir: str, default_id: str) -> None:
+        self.model_dir = model_dir
+        self.default_id = default_id
+        self.entries: Dict[str, ModelEntry] = {}
+        self.error = ""
+
+    def start(self) -> None:
+        try:
+            paths = _discover_models(self.model_dir, ("*.onnx",) if Config.backend == "onnxruntime" else ("*.pt", "*.onnx"))
+            if self.default_id and self.default_id not in paths:
+                raise FileNotFoundError(f"DEFAULT_MODEL={self.default_id} not found under MODEL_DIR={self.model_dir}")
+        except Exception as exc:  # noqa: BLE001
+            self.error = str(exc)
+            LOGGER.error("model discovery failed err=%s", exc)
+            return
+        self.default_id = self.default_id or next(iter(paths))
+        for model_id, path in paths.items():
+            entry = self.entries[model_id] = ModelEntry(model_id=model_id, path=path)
+            MODEL_QUEUE_DEPTH.labels(model=model_id).set_function(lambda entry=entry: entry.pending)
+        Thread(target=self._load_all, daemon=True, name="model-loader").start()
+
+    def states(self) -> Dict[str, str]:
+        return {model_id: entry.state for model_id, entry in self.entries.items()}
+
+    def get(self, model_id: Optional[str]) -> ModelEntry:
+        entry = self.entries.get(model_id or self.default_id)
+        if entry is None:
+            if self.error:
+                raise HTTPException(status_code=503, detail=f"Model not ready: {self.error}")
+            raise HTTPException(status_code=404, detail=f"Unknown model {model_id}")
+        if entry.state != "ready":
+            raise HTTPException(
+                status_code=503,
+                detail=f"Model {entry.model_id} is {entry.state}",
+                headers={"Retry-After": Config.retry_after_s},
+            )
+        return entry
+
+    def _load_all(self) -> None:
+        # The default model goes first so the service is ready as early as possible.
+        entries = sorted(self.entries.values(), key=lambda entry: entry.model_id != self.default_id)
+        for entry in entries:
+            try:
+                entry.state = "loading"
+                started = time.monotonic()
+                entry.backend = _create_backend(entry.path)
+                entry.state = "warming"
+                self._warm_up(entry.backend)
+                entry.batcher = MicroBatcher(
+                    entry.model_id,
+                    entry.backend.predict,
+                    Config.batch_window_ms,
+                    Config.max_batch_size,
+                    workers=Config.infer_workers,
+                )
+                entry.state = "ready"
+                LOGGER.info(
+                    "model ready id=%s path=%s backend=%s default=%s load_ms=%.0f",
+                    entry.model_id,
+                    entry.path,
+                    entry.backend.name,
+                    entry.model_id == self.default_id,
+                    (time.monotonic() - started) * 1000.0,
+                )
+            except Exception as exc:  # noqa: BLE001
+                entry.state = "failed"
+                LOGGER.error("model load failed id=%s path=%s err=%s", entry.model_id, entry.path, exc)
+
+    def _warm_up(self, backend) -> None:
+        # The first predicts pay for graph compilation and allocator growth; run them on dummy
+        # images at the single-image and full micro-batch sizes before serving.
+        size = max(32, Config.warmup_size)
+        dummy = np.full((size, size, 3), 114, dtype=np.uint8)
+        for batch in sorted({1, max(1, Config.max_batch_size)}):
+            backend.predict([dummy] * batch)
+
+
+_registry = ModelRegistry(Config.model_dir, Config.default_model)
+
+
+def _decode_all(payloads: List[Union[bytes, TensorPayload]], target: int = 0) -> List[np.ndarray]:
+    return [_decode_payload(payload, target) for payload in payloads]
+
+
+def _cache_key(model_id: str, payload: Union[bytes, TensorPayload]) -> bytes:
+    digest = hashlib.blake2b(model_id.encode("utf-8"), digest_size=16)
+    if isinstance(payload, TensorPayload):
+        digest.update(f"|tensor|{payload.shape}|{payload.order}|".encode("ascii"))
+        digest.update(payload.data)
+    else:
+        digest.update(b"|jpeg|")
+        digest.update(payload)
+    return digest.digest()
+
+
+def _lookup_and_decode(
+    model_id: str,
+    payloads: List[Union[bytes, TensorPayload]],
+    use_cache: bool,
+    target: int = 0,
+) -> Tuple[List[Optional[bytes]], List[Optional[Detections]], List[int], List[np.ndarray]]:
+    # Runs on the decode pool: hashing a raw tensor costs about as much as copying it. Returns the
+    # cached results and the images left to infer; identical images in one request are inferred once.
+    results: List[Optional[Detections]] = [None] * len(payloads)
+    if not _result_cache.enabled:
+        return [None] * len(payloads), results, list(range(len(payloads))), _decode_all(payloads, target)
+    keys: List[Optional[bytes]] = [_cache_key(model_id, payload) for payload in payloads]
+    if use_cache:
+        results = [_result_cache.get(key) for key in keys]
+        hits = sum(1 for result in results if result is not None)
+        RESULT_CACHE.labels(result="hit").inc(hits)
+        RESULT_CACHE.labels(result="miss").inc(len(payloads) - hits)
+    else:
+        RESULT_CACHE.labels(result="bypass").inc(len(payloads))
+    first: dict = {}
+    for idx, key in enumerate(keys):
+        if results[idx] is None:
+            first.setdefault(key, idx)
+    missing = list(first.values())
+    return keys, results, missing, [_decode_payload(payloads[idx], target) for idx in missing]
+
+
+def _cache_bypassed(request: Request) -> bool:
+    cache_control = request.headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+
+async def _infer(
+    payloads: List[Union[bytes, TensorPayload]],
+    model_id: Optional[str] = None,
+    use_cache: bool = True,
+) -> List[Detections]:
+    entry = _registry.get(model_id)
+    # Admission happens before decode so a saturated detector answers in microseconds.
+    if not _admission.try_acquire(len(payloads)):
+        REJECTED.inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Inference queue is full",
+            headers={"Retry-After": Config.retry_after_s},
+        )
+    entry.pending += len(payloads)
+    try:
+        loop = asyncio.get_running_loop()
+        keys, results, missing, images = await loop.run_in_executor(
+            _decode_pool, _lookup_and_decode, entry.model_id, payloads, use_cache, entry.backend.input_size
+        )
+        if images:
+            outputs = await asyncio.wrap_future(entry.batcher.submit(images))
+            inferred = {}
+            for idx, detections in zip(missing, outputs):
+                results[idx] = detections
+                if keys[idx] is not None:
+                    inferred[keys[idx]] = detections
+                    _result_cache.put(keys[idx], detections)
+            for idx, result in enumerate(results):
+                if result is None:
+                    results[idx] = inferred[keys[idx]]
+        return results
+    finally:
+        entry.pending -= len(payloads)
+        _admission.release(len(payloads))
+
+
+def _split_batch(body: bytes, sizes_header: str) -> List[bytes]:
+    try:
+        sizes = [int(part) for part in sizes_header.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid X-Batch-Sizes header")
+    if not sizes or any(size <= 0 for size in sizes) or sum(sizes) != len(body):
+        raise HTTPException(status_code=400, detail="X-Batch-Sizes does not match payload")
+    if len(sizes) > Config.max_batch_items:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {Config.max_batch_items} images")
+    parts = []
+    offset = 0
+    for size in sizes:
+        parts.append(body[offset:offset + size])
+        offset += size
+    return parts
+
+
+def _split_tensors(body: bytes, shapes_header: str, order: str) -> List[TensorPayload]:
+    # X-Tensor-Shape: "h,w,c" for one image, "h,w,c;h,w,c" for a batch; uint8 only.
+    try:
+        shapes = [tuple(int(dim) for dim in shape.split(",")) for shape in shapes_header.split(";") if shape.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid X-Tensor-Shape header")
+    if not shapes or any(len(shape) not in (2, 3) or min(shape) <= 0 for shape in shapes):
+        raise HTTPException(status_code=400, detail="X-Tensor-Shape must list h,w[,c] per image")
+    if any(len(shape) == 3 and shape[2] != 3 for shape in shapes):
+        raise HTTPException(status_code=400, detail="Tensor payloads must have 1 or 3 channels")
+    if order not in ("rgb", "bgr"):
+        raise HTTPException(status_code=400, detail="X-Tensor-Order must be rgb or bgr")
+    if len(shapes) > Config.max_batch_items:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {Config.max_batch_items} images")
+    sizes = [int(np.prod(shape)) for shape in shapes]
+    if sum(sizes) != len(body):
+        raise HTTPException(status_code=400, detail="X-Tensor-Shape does not match payload")
+    view = memoryview(body)
+    payloads = []
+    offset = 0
+    for shape, size in zip(shapes, sizes):
+        payloads.append(TensorPayload(data=view[offset:offset + size], shape=shape, order=order))
+        offset += size
+    return payloads
+
+
+def _parse_letterboxes(header: str, count: int) -> List[Optional[Tuple[float, float, float, float]]]:
+    # X-Letterbox: "x0,y0,x1,y1" per image, ";"-separated, empty for images sent without padding.
+    # The values are the content region of the padded image as fractions of its size.
+    if not header:
+        return [None] * count
+    parts = header.split(";")
+    if len(parts) != count:
+        raise HTTPException(status_code=400, detail="X-Letterbox does not match the number of images")
+    letterboxes = []
+    for part in parts:
+        if not part.strip():
+            letterboxes.append(None)
+            continue
+        try:
+            x0, y0, x1, y1 = (float(value) for value in part.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid X-Letterbox header")
+        letterboxes.append(_checked_letterbox(x0, y0, x1, y1))
+    return letterboxes
+
+
+def _checked_letterbox(x0: float, y0: float, x1: float, y1: float) -> Tuple[float, float, float, float]:
+    if not (0.0 <= x0 < x1 <= 1.0 and 0.0 <= y0 < y1 <= 1.0):
+        raise HTTPException(status_code=400, detail="Letterbox must satisfy 0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1")
+    return x0, y0, x1, y1
+
+
+def _apply_letterbox(detections: Detections, letterbox: Optional[Tuple[float, float, float, float]]) -> Detections:
+    # Maps boxes normalised to the padded model input back to the original crop. Returns a copy:
+    # the input may be shared with the result cache.
+    if letterbox is None or not len(detections):
+        return detections
+    x0, y0, x1, y1 = letterbox
+    out = detections.copy()
+    origin = np.array([x0, y0, x0, y0], dtype=np.float32)
+    extent = np.array([x1 - x0, y1 - y0, x1 - x0, y1 - y0], dtype=np.float32)
+    out[:, 2:6] = np.clip((detections[:, 2:6] - origin) / extent, 0.0, 1.0)
+    # Boxes lying entirely in the padding clip to zero width or height.
+    return out[(out[:, 4] > out[:, 2]) & (out[:, 5] > out[:, 3])]
+
+
+def _json_rows(detections: Detections) -> List[list]:
+    rows = np.round(detections.astype(np.float64), 6).tolist()
+    for row in rows:
+        row[0] = int(row[0])
+    return rows
+
+
+def _detections_response(request: Request, results: List[Detections], batch: bool) -> Response:
+    # Accept: application/x-safehaven-detections returns the packed rows; for /detect_batch the
+    # rows of all images are concatenated and X-Detection-Counts gives the row count per image.
+    if DETECTIONS_CONTENT_TYPE in request.headers.get("accept", ""):
+        body = b"".join(np.ascontiguousarray(detections, dtype="<f4").tobytes() for detections in results)
+        headers = {"X-Detection-Counts": ",".join(str(len(detections)) for detections in results)} if batch else None
+        return Response(body, media_type=DETECTIONS_CONTENT_TYPE, headers=headers)
+    payload = [_json_rows(detections) for detections in results] if batch else _json_rows(results[0])
+    return Response(json.dumps(payload, separators=(",", ":")), media_type="application/json")
+
+
+async def _read_payloads(request: Request, batch: bool) -> List[Union[bytes, TensorPayload]]:
     content_type = request.headers.get("content-type", "")
-    if "image/jpeg" not in content_type:
-        raise HTTPException(status_code=415, detail="Only image/jpeg is supported")
+    is_tensor = TENSOR_CONTENT_TYPE in content_type
+    if not is_tensor and "image/jpeg" not in content_type:
+        raise HTTPException(status_code=415, detail=f"Only image/jpeg or {TENSOR_CONTENT_TYPE} is supported")
 
     body = await request.body()
     if not body:
         raise HTTPException(status_code=400, detail="Empty image payload")
 
+    if is_tensor:
+        payloads = _split_tensors(
+            body,
+            request.headers.get("x-tensor-shape", ""),
+            request.headers.get("x-tensor-order", "rgb").lower(),
+        )
+    elif batch:
+        payloads = _split_batch(body, request.headers.get("x-batch-sizes", ""))
+    else:
+        payloads = [body]
+    if not batch and len(payloads) != 1:
+        raise HTTPException(status_code=400, detail="/detect accepts a single image")
+    return payloads
+
+
+@app.post("/detect")
+async def detect(request: Request, model: Optional[str] = None):
+    payloads = await _read_payloads(request, batch=False)
+    letterbox = _parse_letterboxes(request.headers.get("x-letterbox", ""), 1)[0]
+    if Config.mock:
+        results = [_mock_detection()]
+    else:
+        results = await _infer(payloads, model, use_cache=not _cache_bypassed(request))
+    return _detections_response(request, [_apply_letterbox(results[0], letterbox)], batch=False)
+
+
+@app.post("/detect_batch")
+async def detect_batch(request: Request, model: Optional[str] = None):
+    payloads = await _read_payloads(request, batch=True)
+    letterboxes = _parse_letterboxes(request.headers.get("x-letterbox", ""), len(payloads))
     if Config.mock:
-        return _mock_detection()
+        results = [_mock_detection() for _ in payloads]
+    else:
+        results = await _infer(payloads, model, use_cache=not _cache_bypassed(request))
+    return _detections_response(
+        request,
+        [_apply_letterbox(detections, letterbox) for detections, letterbox in zip(results, letterboxes)],
+        batch=True,
+    )
 
+
+def _attach_ring(payload: bytes, shape) -> Tuple[mmap.mmap, int]:
+    path = Path(bytes(payload).decode("utf-8")).resolve()
+    if path.parent != Path(Config.uds_path).resolve().parent:
+        raise HTTPException(status_code=403, detail="Ring file must be in the socket directory")
+    slot_bytes = int(np.prod(shape))
+    with open(path, "rb") as handle:
+        ring = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    if slot_bytes <= 0 or len(ring) < slot_bytes:
+        ring.close()
+        raise HTTPException(status_code=400, detail="Ring file is smaller than one slot")
+    LOGGER.info("uds ring attached path=%s slots=%s slot_bytes=%s", path, len(ring) // slot_bytes, slot_bytes)
+    return ring, slot_bytes
+
+
+def _close_ring(ring: Tuple[mmap.mmap, int]) -> None:
     try:
-        pil = Image.open(io.BytesIO(body)).convert("RGB")
-        image = np.array(pil)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid JPEG payload")
+        ring[0].close()
+    except BufferError:
+        # Arrays viewing the ring are still alive; the mapping is released when they are collected.
+        LOGGER.warning("uds ring still in use, leaving it to be unmapped later")
+
+
+async def _retire_ring(ring: Tuple[mmap.mmap, int], pending: set) -> None:
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    _close_ring(ring)
+
+
+def _ring_slot(ring: Optional[Tuple[mmap.mmap, int]], payload: bytes, shape) -> memoryview:
+    if ring is None:
+        raise HTTPException(status_code=400, detail="No shared-memory ring attached")
+    if len(payload) != UDS_SLOT.size:
+        raise HTTPException(status_code=400, detail="Shared-memory request payload must be a slot index")
+    segment, slot_bytes = ring
+    offset = UDS_SLOT.unpack(payload)[0] * slot_bytes
+    size = int(np.prod(shape))
+    if size > slot_bytes or offset + slot_bytes > len(segment):
+        raise HTTPException(status_code=400, detail="Slot index or shape outside the ring")
+    return memoryview(segment)[offset:offset + size]
+
+
+async def _uds_request(
+    writer: asyncio.StreamWriter,
+    request_id: int,
+    kind: int,
+    flags: int,
+    shape,
+    payload: bytes,
+    ring: Optional[Tuple[mmap.mmap, int]] = None,
+):
+    status, retry_after, body = 200, 0, b""
+    try:
+        letterbox = None
+        if flags & UDS_FLAG_LETTERBOX:
+            if len(payload) < UDS_LETTERBOX.size:
+                raise HTTPException(status_code=400, detail="Payload too short for letterbox")
+            letterbox = _checked_letterbox(*UDS_LETTERBOX.unpack_from(payload))
+            payload = memoryview(payload)[UDS_LETTERBOX.size:]
+        if kind == UDS_KIND_JPEG:
+            item = payload
+        elif kind in (UDS_KIND_TENSOR, UDS_KIND_SHM):
+            if len(shape) == 3 and shape[2] != 3:
+                raise HTTPException(status_code=400, detail="Tensor payloads must have 1 or 3 channels")
+            data = memoryview(payload) if kind == UDS_KIND_TENSOR else _ring_slot(ring, payload, shape)
+            if min(shape) <= 0 or int(np.prod(shape)) != len(data):
+                raise HTTPException(status_code=400, detail="Tensor shape does not match payload")
+            item = TensorPayload(data=data, shape=shape, order="bgr" if flags & UDS_FLAG_BGR else "rgb")
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown payload kind {kind}")
+        if Config.mock:
+            detections = _mock_detection()
+        else:
+            detections = (await _infer([item], use_cache=not flags & UDS_FLAG_NO_CACHE))[0]
+        detections = _apply_letterbox(detections, letterbox)
+        body = np.ascontiguousarray(detections, dtype="<f4").tobytes()
+    except HTTPException as exc:
+        status = exc.status_code
+        retry_after = int(float(Config.retry_after_s)) if status == 429 else 0
+        body = str(exc.detail).encode("utf-8")
+    except Exception as exc:  # noqa: BLE001
+        LOGGER.warning("uds request failed id=%s err=%s", request_id, exc)
+        status = 500
+        body = str(exc).encode("utf-8")
+    if not writer.is_closing():
+        writer.write(UDS_RESPONSE.pack(request_id, status, retry_after, len(body)) + body)
+
+
+async def _uds_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Requests are multiplexed: each one runs as its own task and answers may come back out of order.
+    # A ring is unmapped once the requests that read from it are done: on re-attach or disconnect.
+    tasks = set()
+    ring = None
+    ring_tasks = set()
+    try:
+        while True:
+            header = await reader.readexactly(UDS_REQUEST.size)
+            request_id, kind, flags, h, w, c, length = UDS_REQUEST.unpack(header)
+            if length > UDS_MAX_PAYLOAD:
+                LOGGER.warning("uds payload too large id=%s bytes=%s, closing connection", request_id, length)
+                break
+            payload = await reader.readexactly(length)
+            shape = (h, w, c) if c else (h, w)
+            if kind == UDS_KIND_SHM_ATTACH:
+                # Handled in order, so requests after it on this connection see the new ring.
+                status, body = 200, b""
+                try:
+                    attached = _attach_ring(payload, shape)
+                    if ring is not None:
+                        retire = asyncio.create_task(_retire_ring(ring, set(ring_tasks)))
+                        tasks.add(retire)
+                        retire.add_done_callback(tasks.discard)
+                    ring, ring_tasks = attached, set()
+                except HTTPException as exc:
+                    status, body = exc.status_code, str(exc.detail).encode("utf-8")
+                except (OSError, ValueError) as exc:
+                    status, body = 400, str(exc).encode("utf-8")
+                writer.write(UDS_RESPONSE.pack(request_id, status, 0, len(body)) + body)
+                continue
+            task = asyncio.create_task(_uds_request(writer, request_id, kind, flags, shape, payload, ring))
+            for group in (tasks, ring_tasks):
+                group.add(task)
+                task.add_done_callback(group.discard)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+        # In-flight requests finish (their answers are dropped) before the ring they read is unmapped.
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if ring is not None:
+            _close_ring(ring)
+
 
-    model = _get_model()
-    results = model.predict(image, verbose=False)
-    if not results:
-        return []
-
-    result = results[0]
-    h, w = image.shape[:2]
-    detections = []
-    for box in result.boxes:
-        xyxy = box.xyxy[0].tolist()
-        x1, y1, x2, y2 = xyxy
-        class_id = int(box.cls[0].item())
-        score = float(box.conf[0].item())
-        detections.append([
-            class_id,
-            score,
-            max(0.0, min(1.0, x1 / w)),
-            max(0.0, min(1.0, y1 / h)),
-            max(0.0, min(1.0, x2 / w)),
-            max(0.0, min(1.0, y2 / h)),
-        ])
-
-    return detections
+async def _start_uds_server(path: str) -> None:
+    global _uds_server
+    sock_path = Path(path)
+    if sock_path.exists():
+        sock_path.unlink()
+    _uds_server = await asyncio.start_unix_server(_uds_connection, path=path)
+    os.chmod(path, 0o666)
+    LOGGER.info("metis-detector unix socket listening path=%s", path)
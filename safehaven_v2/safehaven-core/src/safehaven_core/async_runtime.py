@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+
+from .config import AppConfig
+from .event_outbox import AsyncEventOutbox
+from .frigate_api import AsyncFrigateApi
+from .metis_client import AsyncMetisClient, UdsMetisClient, create_metis_client
+from .metrics import E2E_MS
+from .notifier import Notifier, emit_zone_event
+from .pipeline import CameraRuntime, ZonePipeline, call_metis, jpg_bytes
+from .preprocess import Letterbox
+from .rtsp_sampler import SAMPLER_RESTART_S, sample_stream
+
+LOGGER = logging.getLogger(__name__)
+
+
+async def _call_metis(
+    metis: AsyncMetisClient | UdsMetisClient,
+    roi_frames: list[np.ndarray],
+    letterboxes: list[Letterbox | None],
+    executor: ThreadPoolExecutor,
+) -> list[list[list[float]]]:
+    loop = asyncio.get_running_loop()
+    if isinstance(metis, UdsMetisClient):
+        # The Unix-socket client multiplexes blocking callers; run it off the loop.
+        return await loop.run_in_executor(None, call_metis, metis, roi_frames, letterboxes)
+    if metis.raw_tensors:
+        return await metis.detect_tensors(roi_frames, letterboxes)
+    payloads = await loop.run_in_executor(executor, lambda: [jpg_bytes(roi_frame) for roi_frame in roi_frames])
+    return await metis.detect_batch(payloads, letterboxes=letterboxes)
+
+
+async def _capture(config: AppConfig, runtime: CameraRuntime, executor: ThreadPoolExecutor) -> None:
+    # Each read runs in the shared capture executor; the read sampler is paced here on the loop so an
+    # idle camera holds no thread. grab/ffmpeg cameras pace themselves and wait in the executor.
+    camera = runtime.camera
+    scheduler = runtime.scheduler
+    loop = asyncio.get_running_loop()
+    while True:
+        frames = sample_stream(
+            camera.stream_url,
+            scheduler.max_fps if scheduler else config.sample_fps,
+            fps_fn=(lambda: scheduler.fps) if scheduler else None,
+            mode=camera.sampler,
+            camera=camera.name,
+            ffmpeg=camera.ffmpeg,
+            pool=runtime.pool,
+            pace=False,
+        )
+        try:
+            while True:
+                start = time.time()
+                frame, ts = await loop.run_in_executor(executor, next, frames)
+                runtime.mailbox.put(frame, ts)
+                if camera.sampler == "read":
+                    fps = scheduler.fps if scheduler else config.sample_fps
+                    await asyncio.sleep(max(0.0, 1.0 / max(fps, 0.1) - (time.time() - start)))
+        except Exception:
+            # Contained to this camera; an exception escaping the task would end gather() for all of them.
+            LOGGER.exception("Sampler error camera=%s; restarting the stream", camera.name)
+            await asyncio.sleep(SAMPLER_RESTART_S)
+
+
+async def _camera_task(
+    config: AppConfig,
+    runtime: CameraRuntime,
+    events: Notifier,
+    metis: AsyncMetisClient | UdsMetisClient,
+    executor: ThreadPoolExecutor,
+) -> None:
+    pipeline = ZonePipeline(config, runtime)
+    while True:
+        frame, sampled_ts = await runtime.mailbox.get()
+        try:
+            await _process_frame(pipeline, runtime, events, metis, executor, frame, sampled_ts)
+        except Exception:
+            # A bad frame is logged and skipped; it must not stop this camera or the others.
+            LOGGER.exception("Frame error camera=%s", runtime.camera.name)
+
+
+async def _process_frame(
+    pipeline: ZonePipeline,
+    runtime: CameraRuntime,
+    events: Notifier,
+    metis: AsyncMetisClient | UdsMetisClient,
+    executor: ThreadPoolExecutor,
+    frame: np.ndarray,
+    sampled_ts: float,
+) -> None:
+    camera = runtime.camera
+    now = time.time()
+    try:
+        work = pipeline.start(frame, now)
+        if work is not None and work.pending:
+            try:
+                results = await _call_metis(metis, *pipeline.inputs(work), executor)
+                pipeline.observe(work, results, now)
+            except Exception as exc:
+                LOGGER.warning("Inference error camera=%s zones=%s err=%s", camera.name, work.pending, exc)
+    finally:
+        runtime.pool.release(frame)
+    if work is None:
+        return
+
+    for event in pipeline.finish(work, now):
+        emit_zone_event(events, camera.name, event)
+    for update in pipeline.states(work, now):
+        events.put(update)
+
+    E2E_MS.observe((time.time() - sampled_ts) * 1000.0)
+
+
+async def _main(config: AppConfig, runtimes: list[CameraRuntime], events: Notifier) -> None:
+    readers = sum(1 for runtime in runtimes if runtime.camera.sampler == "read")
+    workers = config.capture_workers or (min(4, readers) + len(runtimes) - readers)
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="capture")
+    limits = httpx.Limits(
+        max_connections=config.metis_pool_size + config.outbox_concurrency,
+        max_keepalive_connections=config.metis_pool_size + config.outbox_concurrency,
+    )
+    timeout = httpx.Timeout(config.metis_timeout, connect=config.metis_connect_timeout)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        if config.metis_detector_url.startswith("unix://"):
+            metis = create_metis_client(config)
+        else:
+            metis = AsyncMetisClient(
+                client,
+                config.metis_detector_url,
+                pool_size=config.metis_pool_size,
+                transport=config.metis_transport,
+            )
+        tasks = []
+        if isinstance(events.outbox, AsyncEventOutbox):
+            frigate = AsyncFrigateApi(client, config.frigate_base_url)
+            tasks.append(asyncio.create_task(events.outbox.run(frigate), name="event-outbox"))
+        for runtime in runtimes:
+            tasks.append(asyncio.create_task(_capture(config, runtime, executor), name=f"sampler-{runtime.camera.name}"))
+            tasks.append(
+                asyncio.create_task(
+                    _camera_task(config, runtime, events, metis, executor),
+                    name=f"worker-{runtime.camera.name}",
+                )
+            )
+        LOGGER.info("asyncio runtime started cameras=%s capture_workers=%s", len(runtimes), workers)
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_async(config: AppConfig, runtimes: list[CameraRuntime], events: Notifier) -> None:
+    asyncio.run(_main(config, runtimes, events))
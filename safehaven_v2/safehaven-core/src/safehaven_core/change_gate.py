@@ -0,0 +1,49 @@
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from .metrics import CHANGE_GATE
+from .state_machines import ZoneState
+
+
+@dataclass
+class _InferredSample:
+    fingerprint: np.ndarray
+    state: ZoneState
+    score: float
+    ts: float
+
+
+class ZoneChangeGate:
+    # Compares a tiny grayscale thumbnail of the ROI with the one last sent to Metis. While the
+    # mean absolute difference stays under threshold (and the cached result is younger than
+    # max_age_s) the cached observation is reused instead of calling the detector again.
+    def __init__(self, camera: str, zone: str, threshold: float, max_age_s: float, size: int = 16) -> None:
+        self.threshold = threshold
+        self.max_age_s = max_age_s
+        self.size = size
+        self._last: _InferredSample | None = None
+        self._hits = CHANGE_GATE.labels(camera=camera, zone=zone, result="hit")
+        self._misses = CHANGE_GATE.labels(camera=camera, zone=zone, result="miss")
+
+    def fingerprint(self, roi_frame: np.ndarray) -> np.ndarray:
+        thumb = cv2.resize(roi_frame, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        if thumb.ndim == 3:
+            thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        return thumb.astype(np.int16)
+
+    def lookup(self, fingerprint: np.ndarray, now: float) -> tuple[ZoneState, float] | None:
+        last = self._last
+        if (
+            last is not None
+            and now - last.ts < self.max_age_s
+            and float(np.abs(fingerprint - last.fingerprint).mean()) < self.threshold
+        ):
+            self._hits.inc()
+            return last.state, last.score
+        self._misses.inc()
+        return None
+
+    def store(self, fingerprint: np.ndarray, state: ZoneState, score: float, now: float) -> None:
+        self._last = _InferredSample(fingerprint=fingerprint, state=state, score=score, ts=now)
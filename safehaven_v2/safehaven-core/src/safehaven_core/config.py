@@ -1,6 +1,6 @@
 import json
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
@@ -15,21 +15,59 @@ class ROI:
     h: float
 
 
+@dataclass
+class FfmpegConfig:
+    width: int | None = None
+    height: int | None = None
+    crop: ROI | None = None
+    rtsp_transport: str = "tcp"
+
+
+@dataclass
+class PreprocessConfig:
+    size: int = 0
+    fit: str = "letterbox"
+
+
 @dataclass
 class CameraConfig:
     name: str
     stream_url: str
     rois: dict[str, ROI]
+    sampler: str = "read"
+    ffmpeg: FfmpegConfig | None = None
+    queue_max: int | None = None
+    max_frame_age_s: float | None = None
+    preprocess: dict[str, PreprocessConfig] = field(default_factory=dict)
 
 
 @dataclass
 class AppConfig:
     frigate_base_url: str
     metis_detector_url: str
+    metis_pool_size: int
+    metis_timeout: float
+    metis_connect_timeout: float
+    metis_transport: str
     mqtt_broker: str | None
+    mqtt_topic_prefix: str
+    mqtt_heartbeat_s: float
+    outbox_spool: str
+    outbox_concurrency: int
+    outbox_max_age_s: float
     sample_fps: float
+    adaptive_sampling: bool
+    change_threshold: float
+    change_max_age_s: float
     left_open_minutes: int
     queue_max: int
+    max_frame_age_s: float
+    frame_pool_bytes: int
+    execution_mode: str
+    worker_processes: int
+    capture_workers: int
+    inference_layout: str
+    mosaic_size: int
     metrics_port: int
     health_port: int
     log_format: str
@@ -46,15 +84,41 @@ def _parse_roi(raw: dict[str, Any]) -> ROI:
     )
 
 
-def _parse_cameras(raw_cameras: list[dict[str, Any]]) -> list[CameraConfig]:
+def _parse_ffmpeg(raw: dict[str, Any] | None) -> FfmpegConfig | None:
+    if raw is None:
+        return None
+    return FfmpegConfig(
+        width=int(raw["width"]) if raw.get("width") else None,
+        height=int(raw["height"]) if raw.get("height") else None,
+        crop=_parse_roi(raw["crop"]) if raw.get("crop") else None,
+        rtsp_transport=str(raw.get("rtsp_transport", "tcp")),
+    )
+
+
+def _parse_preprocess(raw: dict[str, Any], default: PreprocessConfig) -> PreprocessConfig:
+    return PreprocessConfig(
+        size=int(raw.get("size", default.size) or 0),
+        fit=str(raw.get("fit", default.fit)).lower(),
+    )
+
+
+def _parse_cameras(raw_cameras: list[dict[str, Any]], preprocess: PreprocessConfig) -> list[CameraConfig]:
     cameras: list[CameraConfig] = []
     for item in raw_cameras:
         rois = {k: _parse_roi(v) for k, v in item.get("rois", {}).items()}
+        zone_preprocess = {
+            k: _parse_preprocess(v.get("preprocess") or {}, preprocess) for k, v in item.get("rois", {}).items()
+        }
         cameras.append(
             CameraConfig(
                 name=item["name"],
                 stream_url=item["stream_url"],
                 rois=rois,
+                sampler=str(item.get("sampler", "read")).lower(),
+                ffmpeg=_parse_ffmpeg(item.get("ffmpeg")),
+                queue_max=int(item["queue_max"]) if item.get("queue_max") else None,
+                max_frame_age_s=float(item["max_frame_age_s"]) if item.get("max_frame_age_s") is not None else None,
+                preprocess=zone_preprocess,
             )
         )
     return cameras
@@ -72,17 +136,41 @@ def load_config() -> AppConfig:
     else:
         raw_cameras = yaml_data.get("cameras", [])
 
-    cameras = _parse_cameras(raw_cameras)
+    preprocess = PreprocessConfig(
+        size=int(os.getenv("PREPROCESS_SIZE", yaml_data.get("preprocess_size", 0))),
+        fit=str(os.getenv("PREPROCESS_FIT", yaml_data.get("preprocess_fit", "letterbox"))).lower(),
+    )
+    cameras = _parse_cameras(raw_cameras, preprocess)
     if not cameras:
         raise ValueError("No cameras configured. Set CAMERAS env or SAFEHAVEN_CONFIG cameras list.")
 
     return AppConfig(
         frigate_base_url=os.getenv("FRIGATE_BASE_URL", "http://frigate:5000"),
         metis_detector_url=os.getenv("METIS_DETECTOR_URL", "http://metis-detector:8090/detect"),
-        mqtt_broker=os.getenv("MQTT_BROKER", yaml_data.get("mqtt_broker")),
+        metis_pool_size=int(os.getenv("METIS_POOL_SIZE", yaml_data.get("metis_pool_size", 8))),
+        metis_timeout=float(os.getenv("METIS_TIMEOUT", yaml_data.get("metis_timeout", 1.0))),
+        metis_connect_timeout=float(os.getenv("METIS_CONNECT_TIMEOUT", yaml_data.get("metis_connect_timeout", 0.5))),
+        metis_transport=str(os.getenv("METIS_TRANSPORT", yaml_data.get("metis_transport", "auto"))).lower(),
+        mqtt_broker=os.getenv("MQTT_BROKER", yaml_data.get("mqtt_broker")) or None,
+        mqtt_topic_prefix=str(os.getenv("MQTT_TOPIC_PREFIX", yaml_data.get("mqtt_topic_prefix", "safehaven"))),
+        mqtt_heartbeat_s=float(os.getenv("MQTT_HEARTBEAT_S", yaml_data.get("mqtt_heartbeat_s", 60))),
+        outbox_spool=str(os.getenv("OUTBOX_SPOOL", yaml_data.get("outbox_spool", "/var/lib/safehaven/outbox.jsonl"))),
+        outbox_concurrency=int(os.getenv("OUTBOX_CONCURRENCY", yaml_data.get("outbox_concurrency", 4))),
+        outbox_max_age_s=float(os.getenv("OUTBOX_MAX_AGE_S", yaml_data.get("outbox_max_age_s", 3600))),
         sample_fps=float(os.getenv("SAMPLE_FPS", yaml_data.get("sample_fps", 1))),
+        adaptive_sampling=str(os.getenv("ADAPTIVE_SAMPLING", yaml_data.get("adaptive_sampling", False))).lower()
+        in ("1", "true", "yes", "on"),
+        change_threshold=float(os.getenv("CHANGE_THRESHOLD", yaml_data.get("change_threshold", 3.0))),
+        change_max_age_s=float(os.getenv("CHANGE_MAX_AGE_S", yaml_data.get("change_max_age_s", 30.0))),
         left_open_minutes=int(os.getenv("LEFT_OPEN_MINUTES", yaml_data.get("left_open_minutes", 7))),
-        queue_max=int(os.getenv("QUEUE_MAX", yaml_data.get("queue_max", 50))),
+        queue_max=int(os.getenv("QUEUE_MAX", yaml_data.get("queue_max", 1))),
+        max_frame_age_s=float(os.getenv("MAX_FRAME_AGE_S", yaml_data.get("max_frame_age_s", 5.0))),
+        frame_pool_bytes=int(os.getenv("FRAME_POOL_BYTES", yaml_data.get("frame_pool_bytes", 256 * 1024 * 1024))),
+        execution_mode=str(os.getenv("EXECUTION_MODE", yaml_data.get("execution_mode", "threads"))).lower(),
+        worker_processes=int(os.getenv("WORKER_PROCESSES", yaml_data.get("worker_processes", 0))),
+        capture_workers=int(os.getenv("CAPTURE_WORKERS", yaml_data.get("capture_workers", 0))),
+        inference_layout=str(os.getenv("INFERENCE_LAYOUT", yaml_data.get("inference_layout", "batch"))).lower(),
+        mosaic_size=int(os.getenv("MOSAIC_SIZE", yaml_data.get("mosaic_size", 640))),
         metrics_port=int(os.getenv("METRICS_PORT", yaml_data.get("metrics_port", 9108))),
         health_port=int(os.getenv("HEALTH_PORT", yaml_data.get("health_port", 9109))),
         log_format=str(os.getenv("LOG_FORMAT", yaml_data.get("log_format", "text"))),
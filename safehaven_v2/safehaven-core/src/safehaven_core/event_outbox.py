@@ -0,0 +1,305 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import httpx
+import requests
+
+from .frigate_api import AsyncFrigateApi, FrigateApi
+from .metrics import OUTBOX_DELIVERY_MS
+
+LOGGER = logging.getLogger(__name__)
+
+# Retries back off exponentially from BACKOFF_S up to MAX_BACKOFF_S.
+BACKOFF_S = 1.0
+MAX_BACKOFF_S = 60.0
+# The spool is rewritten with just the undelivered events once this many have been settled.
+COMPACT_AFTER = 1024
+
+
+@dataclass
+class OutboxEvent:
+    camera: str
+    label: str
+    sub_label: str
+    score: float | None = None
+    duration: int | None = None
+    created: float = field(default_factory=time.time)
+    id: int = 0
+
+
+class EventOutbox:
+    # Decouples Frigate Create Event calls from the camera workers. put() only appends to a deque
+    # and sets an event, so a slow or restarting Frigate never stalls inference. One sender thread
+    # appends new events to an append-only JSON-lines spool, hands them to at most `concurrency`
+    # requests on a pooled session and retries transport errors, 429 and 5xx with exponential
+    # backoff; other statuses and events older than max_age_s are dropped. Settled events are
+    # recorded in the spool as acks, so a restart replays only the undelivered ones (delivery is
+    # at least once). Counters are read by the metrics collector on scrape.
+    def __init__(
+        self,
+        frigate: FrigateApi,
+        spool_path: str = "",
+        concurrency: int = 4,
+        max_age_s: float = 3600.0,
+    ) -> None:
+        self.frigate = frigate
+        self.spool_path = Path(spool_path) if spool_path else None
+        self.concurrency = max(1, concurrency)
+        self.max_age_s = max_age_s
+        self.delivered = 0
+        self.failures = {"error": 0, "rejected": 0, "expired": 0}
+        self.spool_bytes = 0
+        self._incoming: deque[OutboxEvent] = deque()
+        self._done: deque[tuple[OutboxEvent, int | None]] = deque()
+        self._wake = threading.Event()
+        self._pending: dict[int, OutboxEvent] = {}
+        self._attempts: dict[int, int] = {}
+        self._ready: deque[OutboxEvent] = deque()
+        self._retries: list[tuple[float, int]] = []
+        self._in_flight = 0
+        self._next_id = 1
+        self._settled = 0
+        self._spool = None
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="outbox-send")
+
+    def put(self, event: OutboxEvent) -> None:
+        self._incoming.append(event)
+        self._notify()
+
+    def depth(self) -> int:
+        return len(self._incoming) + len(self._pending)
+
+    def start(self) -> None:
+        self._open_spool()
+        threading.Thread(target=self._run, daemon=True, name="event-outbox").start()
+
+    def _notify(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self._step()
+            self._wake.wait(self._timeout())
+            self._wake.clear()
+
+    def _timeout(self) -> float | None:
+        return max(0.0, self._retries[0][0] - time.monotonic()) if self._retries else None
+
+    def _step(self) -> None:
+        self._accept()
+        self._settle()
+        now = time.monotonic()
+        while self._retries and self._retries[0][0] <= now:
+            event = self._pending.get(heapq.heappop(self._retries)[1])
+            if event is not None:
+                self._ready.append(event)
+        while self._ready and self._in_flight < self.concurrency:
+            event = self._ready.popleft()
+            if time.time() - event.created > self.max_age_s:
+                self.failures["expired"] += 1
+                LOGGER.warning("Dropping expired event camera=%s label=%s", event.camera, event.label)
+                self._ack(event)
+                continue
+            self._in_flight += 1
+            self._dispatch(event)
+        if self._settled >= COMPACT_AFTER:
+            try:
+                self._compact()
+            except OSError as exc:
+                LOGGER.warning("Event spool compaction failed path=%s err=%s", self.spool_path, exc)
+
+    def _accept(self) -> None:
+        lines = []
+        while self._incoming:
+            event = self._incoming.popleft()
+            event.id = self._next_id
+            self._next_id += 1
+            self._pending[event.id] = event
+            self._ready.append(event)
+            lines.append(json.dumps(asdict(event), separators=(",", ":")))
+        if lines:
+            self._write(lines)
+
+    def _dispatch(self, event: OutboxEvent) -> None:
+        self._executor.submit(self._send, event).add_done_callback(self._sent)
+
+    def _send(self, event: OutboxEvent) -> tuple[OutboxEvent, int | None]:
+        try:
+            response = self.frigate.create_event(
+                camera=event.camera,
+                label=event.label,
+                sub_label=event.sub_label,
+                score=event.score,
+                duration=event.duration,
+            )
+        except requests.RequestException as exc:
+            LOGGER.warning("Create Event request error camera=%s label=%s err=%s", event.camera, event.label, exc)
+            return event, None
+        except Exception:
+            # Anything else is retried too; letting it escape would leak the in-flight slot.
+            LOGGER.exception("Create Event failed camera=%s label=%s", event.camera, event.label)
+            return event, None
+        return self._result(event, response.status_code, response.text)
+
+    def _result(self, event: OutboxEvent, status: int, body: str) -> tuple[OutboxEvent, int]:
+        if status >= 300:
+            LOGGER.warning(
+                "Create Event failed camera=%s label=%s status=%s body=%s", event.camera, event.label, status, body
+            )
+        return event, status
+
+    def _sent(self, future: Future) -> None:
+        self._done.append(future.result())
+        self._notify()
+
+    def _settle(self) -> None:
+        while self._done:
+            event, status = self._done.popleft()
+            self._in_flight -= 1
+            if status is not None and status < 300:
+                self.delivered += 1
+                OUTBOX_DELIVERY_MS.observe((time.time() - event.created) * 1000.0)
+                self._ack(event)
+            elif status is None or status == 429 or status >= 500:
+                self.failures["error"] += 1
+                attempts = self._attempts[event.id] = self._attempts.get(event.id, 0) + 1
+                delay = min(MAX_BACKOFF_S, BACKOFF_S * 2 ** (attempts - 1))
+                heapq.heappush(self._retries, (time.monotonic() + delay, event.id))
+            else:
+                self.failures["rejected"] += 1
+                self._ack(event)
+
+    def _ack(self, event: OutboxEvent) -> None:
+        self._pending.pop(event.id, None)
+        self._attempts.pop(event.id, None)
+        self._settled += 1
+        self._write([json.dumps({"ack": event.id})])
+
+    def _open_spool(self) -> None:
+        if self.spool_path is None:
+            return
+        try:
+            self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+            self._replay()
+            self._compact()
+        except OSError as exc:
+            LOGGER.warning("Event spool unavailable path=%s err=%s; events are kept in memory only", self.spool_path, exc)
+            self.spool_path = None
+            return
+        if self._pending:
+            LOGGER.info("Replaying %s undelivered events from %s", len(self._pending), self.spool_path)
+
+    def _replay(self) -> None:
+        if not self.spool_path.exists():
+            return
+        with self.spool_path.open("r", encoding="utf-8") as spool:
+            for line in spool:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write.
+                    continue
+                try:
+                    if "ack" in record:
+                        self._pending.pop(record["ack"], None)
+                        continue
+                    event = OutboxEvent(**record)
+                except (TypeError, KeyError):
+                    # Valid JSON that is not one of our records: another version's schema or a hand edit.
+                    LOGGER.warning("Skipping unreadable event spool record=%s", line.strip())
+                    continue
+                self._pending[event.id] = event
+                self._next_id = max(self._next_id, event.id + 1)
+        self._ready.extend(self._pending.values())
+
+    def _write(self, lines: list[str]) -> None:
+        if self._spool is None:
+            return
+        try:
+            self._spool.write("".join(f"{line}\n" for line in lines))
+            self._spool.flush()
+            os.fsync(self._spool.fileno())
+            self.spool_bytes = self._spool.tell()
+        except OSError as exc:
+            LOGGER.warning("Event spool write failed path=%s err=%s", self.spool_path, exc)
+
+    def _compact(self) -> None:
+        self._settled = 0
+        if self.spool_path is None:
+            return
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        tmp = self.spool_path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as spool:
+            for event in self._pending.values():
+                spool.write(json.dumps(asdict(event), separators=(",", ":")) + "\n")
+            spool.flush()
+            os.fsync(spool.fileno())
+        os.replace(tmp, self.spool_path)
+        self._spool = self.spool_path.open("a", encoding="utf-8")
+        self.spool_bytes = self._spool.tell()
+
+
+class AsyncEventOutbox(EventOutbox):
+    # The asyncio runtime's outbox: the same spool, retries and accounting, but driven from the event
+    # loop, with requests sent on the runtime's shared httpx.AsyncClient. Spool writes stay
+    # synchronous; they are one small appended line per event or ack.
+    def __init__(self, spool_path: str = "", concurrency: int = 4, max_age_s: float = 3600.0) -> None:
+        super().__init__(None, spool_path, concurrency, max_age_s)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._async_wake = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def run(self, frigate: AsyncFrigateApi) -> None:
+        self.frigate = frigate
+        self._loop = asyncio.get_running_loop()
+        self._open_spool()
+        while True:
+            self._step()
+            try:
+                await asyncio.wait_for(self._async_wake.wait(), self._timeout())
+            except asyncio.TimeoutError:
+                pass
+            self._async_wake.clear()
+
+    def _notify(self) -> None:
+        # put() may be called from other threads (the Unix-socket detector client's executor).
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._async_wake.set)
+
+    def _dispatch(self, event: OutboxEvent) -> None:
+        task = asyncio.create_task(self._send_async(event))
+        self._tasks.add(task)
+        task.add_done_callback(self._sent_async)
+
+    async def _send_async(self, event: OutboxEvent) -> tuple[OutboxEvent, int | None]:
+        try:
+            response = await self.frigate.create_event(
+                camera=event.camera,
+                label=event.label,
+                sub_label=event.sub_label,
+                score=event.score,
+                duration=event.duration,
+            )
+        except httpx.HTTPError as exc:
+            LOGGER.warning("Create Event request error camera=%s label=%s err=%s", event.camera, event.label, exc)
+            return event, None
+        except Exception:
+            LOGGER.exception("Create Event failed camera=%s label=%s", event.camera, event.label)
+            return event, None
+        return self._result(event, response.status_code, response.text)
+
+    def _sent_async(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._done.append(task.result())
+        self._async_wake.set()
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import numpy as np
+
+
+class FramePool:
+    # Reusable uint8 frame buffers shared by every sampler and worker, bounded by a byte budget
+    # rather than a frame count. Buffers are kept on per-shape free lists; idle buffers of other
+    # shapes are freed to make room for a new shape. acquire() waits up to timeout for a release
+    # and returns None when the budget stays exhausted, so callers drop the frame instead of growing.
+    def __init__(self, budget_bytes: int) -> None:
+        self.budget_bytes = budget_bytes
+        self.allocated_bytes = 0
+        self.in_use_bytes = 0
+        self.allocations = 0
+        self.reuses = 0
+        self.exhausted = 0
+        self._free: dict[tuple[int, ...], list[np.ndarray]] = {}
+        self._in_use: dict[int, np.ndarray] = {}
+        self._cond = threading.Condition()
+
+    def acquire(self, shape: tuple[int, ...], timeout: float = 0.0) -> np.ndarray | None:
+        shape = tuple(int(dim) for dim in shape)
+        nbytes = int(np.prod(shape))
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                free = self._free.get(shape)
+                if free:
+                    buf = free.pop()
+                    self.reuses += 1
+                    break
+                if self._make_room(nbytes):
+                    buf = np.empty(shape, dtype=np.uint8)
+                    self.allocated_bytes += nbytes
+                    self.allocations += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.exhausted += 1
+                    return None
+                self._cond.wait(remaining)
+            self._in_use[id(buf)] = buf
+            self.in_use_bytes += buf.nbytes
+            return buf
+
+    def release(self, buf: np.ndarray) -> None:
+        # Arrays the pool did not hand out (e.g. ones OpenCV reallocated) are left to the GC.
+        with self._cond:
+            if self._in_use.pop(id(buf), None) is None:
+                return
+            self.in_use_bytes -= buf.nbytes
+            self._free.setdefault(buf.shape, []).append(buf)
+            self._cond.notify()
+
+    def idle_bytes(self) -> int:
+        return self.allocated_bytes - self.in_use_bytes
+
+    def _make_room(self, nbytes: int) -> bool:
+        for free in self._free.values():
+            while free and self.allocated_bytes + nbytes > self.budget_bytes:
+                self.allocated_bytes -= free.pop().nbytes
+        # A budget smaller than one frame still lets a single buffer exist.
+        return self.allocated_bytes == 0 or self.allocated_bytes + nbytes <= self.budget_bytes
@@ -1,15 +1,34 @@
-import logging
-
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+
 
-LOGGER = logging.getLogger(__name__)
+def _event_request(
+    base_url: str,
+    camera: str,
+    label: str,
+    sub_label: str,
+    score: float | None,
+    duration: int | None,
+) -> tuple[str, dict]:
+    url = f"{base_url}/api/events/{camera}/{label}/create"
+    payload = {"sub_label": sub_label}
+    if score is not None:
+        payload["score"] = float(score)
+    if duration is not None:
+        payload["duration"] = int(duration)
+    return url, payload
 
 
 class FrigateApi:
-    def __init__(self, base_url: str, timeout: float = 3.0) -> None:
+    # Keep-alive session sized for the outbox's concurrent senders.
+    def __init__(self, base_url: str, timeout: float = 3.0, pool_size: int = 4) -> None:
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def create_event(
         self,
@@ -18,20 +37,27 @@ class FrigateApi:
         sub_label: str,
         score: float | None = None,
         duration: int | None = None,
-    ) -> bool:
-        url = f"{self.base_url}/api/events/{camera}/{label}/create"
-        payload = {"sub_label": sub_label}
-        if score is not None:
-            payload["score"] = float(score)
-        if duration is not None:
-            payload["duration"] = int(duration)
-
-        try:
-            resp = self.session.post(url, json=payload, timeout=self.timeout)
-            if resp.status_code >= 300:
-                LOGGER.warning("Create Event failed url=%s status=%s body=%s", url, resp.status_code, resp.text)
-                return False
-            return True
-        except requests.RequestException as exc:
-            LOGGER.warning("Create Event request error url=%s err=%s", url, exc)
-            return False
+    ) -> requests.Response:
+        # Raises requests.RequestException on transport errors; the caller decides what a status means.
+        url, payload = _event_request(self.base_url, camera, label, sub_label, score, duration)
+        return self.session.post(url, json=payload, timeout=self.timeout)
+
+
+class AsyncFrigateApi:
+    # Used by the asyncio runtime's outbox on the runtime's shared httpx.AsyncClient.
+    def __init__(self, client: httpx.AsyncClient, base_url: str, timeout: float = 3.0) -> None:
+        self.client = client
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    async def create_event(
+        self,
+        camera: str,
+        label: str,
+        sub_label: str,
+        score: float | None = None,
+        duration: int | None = None,
+    ) -> httpx.Response:
+        # Raises httpx.HTTPError on transport errors.
+        url, payload = _event_request(self.base_url, camera, label, sub_label, score, duration)
+        return await self.client.post(url, json=payload, timeout=self.timeout)
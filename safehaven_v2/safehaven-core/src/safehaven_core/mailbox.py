@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+
+import numpy as np
+
+
+class LatestMailbox:
+    # Latest-value handoff between one sampler and one worker. put() never blocks or locks: it
+    # appends to a bounded deque (the oldest frame falls off) and sets an event. get() discards
+    # frames older than max_age_s, so freshness rather than fullness decides what is dropped.
+    # Counters are plain ints owned by one side each and read by the metrics collector on scrape.
+    # Dropped frames are handed to release (the frame pool) so their buffers are recycled.
+    def __init__(
+        self,
+        depth: int = 1,
+        max_age_s: float = 0.0,
+        release: Callable[[np.ndarray], None] | None = None,
+    ) -> None:
+        self.depth = max(1, depth)
+        self.max_age_s = max_age_s
+        self.release = release or (lambda _frame: None)
+        self.overwritten = 0
+        self.expired = 0
+        self._items: deque[tuple[np.ndarray, float]] = deque()
+        self._ready = threading.Event()
+
+    def put(self, frame: np.ndarray, ts: float) -> None:
+        # Only put() appends, so evicting with popleft() keeps the bound; popleft() is atomic,
+        # so a frame is either evicted here or returned by get(), never both.
+        while len(self._items) >= self.depth:
+            try:
+                dropped, _ts = self._items.popleft()
+            except IndexError:
+                break
+            self.overwritten += 1
+            self.release(dropped)
+        self._items.append((frame, ts))
+        self._ready.set()
+
+    def get(self) -> tuple[np.ndarray, float]:
+        while True:
+            try:
+                frame, ts = self._items.popleft()
+            except IndexError:
+                self._ready.clear()
+                if not self._items:
+                    self._ready.wait()
+                continue
+            if self.max_age_s > 0 and time.time() - ts > self.max_age_s:
+                self.expired += 1
+                self.release(frame)
+                continue
+            return frame, ts
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+
+class AsyncLatestMailbox(LatestMailbox):
+    # Same bound and drop accounting for the asyncio runtime, where put() and get() both run on the loop.
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._ready = asyncio.Event()
+
+    async def get(self) -> tuple[np.ndarray, float]:
+        while True:
+            while not self._items:
+                self._ready.clear()
+                await self._ready.wait()
+            frame, ts = self._items.popleft()
+            if self.max_age_s > 0 and time.time() - ts > self.max_age_s:
+                self.expired += 1
+                self.release(frame)
+                continue
+            return frame, ts
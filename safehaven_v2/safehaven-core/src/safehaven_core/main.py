@@ -1,24 +1,40 @@
 import datetime
 import json
 import logging
+import multiprocessing
 import os
-import queue
 import sys
 import threading
 import time
 from dataclasses import dataclass, field
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from urllib.parse import urlsplit, urlunsplit
+from multiprocessing import resource_tracker
 
-import cv2
-import numpy as np
 import requests
 
 from .config import AppConfig, CameraConfig, load_config
+from .async_runtime import run_async
+from .event_outbox import AsyncEventOutbox, EventOutbox
+from .frame_pool import FramePool
 from .frigate_api import FrigateApi
-from .metrics import DROPPED_SAMPLES, E2E_MS, INFER_MS, QUEUE_DEPTH, SEMANTIC_EVENTS, start_metrics_server
-from .rtsp_sampler import crop_roi, sample_stream
-from .state_machines import DebouncedStateMachine, ZoneState
+from .metis_client import MetisClient, UdsMetisClient, create_metis_client
+from .mailbox import AsyncLatestMailbox, LatestMailbox
+from .mqtt_publisher import MqttPublisher, create_mqtt_client, parse_broker
+from .metrics import (
+    E2E_MS,
+    mark_process_dead,
+    register_frame_pools,
+    register_mailboxes,
+    register_mqtt,
+    register_outbox,
+    start_metrics_server,
+)
+from .notifier import Notifier, emit_zone_event
+from .pipeline import CameraRuntime, ZonePipeline, call_metis
+from .rtsp_sampler import SAMPLER_RESTART_S, sample_stream
+from .sampling import SamplingScheduler, ZoneRates
+from .shm_ring import SharedFrameRing
+from .state_machines import DebouncedStateMachine
 
 LOGGER = logging.getLogger(__name__)
 
@@ -28,26 +44,23 @@ ZONE_SPECS = {
         "open_event": "garage_opened",
         "close_event": "garage_closed",
         "left_open_event": "garage_left_open",
+        "sampling": {"idle": 0.2, "confirm": 3.0, "open": 1.0, "confirm_seconds": 10.0},
     },
     "gate": {
         "open_event": "gate_ajar",
         "close_event": "gate_closed",
         "left_open_event": "gate_left_open",
+        "sampling": {"idle": 0.5, "confirm": 3.0, "open": 1.0, "confirm_seconds": 10.0},
     },
     "latch": {
         "open_event": "latch_unlocked",
         "close_event": "latch_locked",
         "left_open_event": "latch_left_open",
+        "sampling": {"idle": 0.2, "confirm": 3.0, "open": 1.0, "confirm_seconds": 10.0},
     },
 }
 
 
-@dataclass
-class CameraRuntime:
-    camera: CameraConfig
-    queue: queue.Queue
-
-
 @dataclass
 class ReadinessState:
     ready: bool = False
@@ -81,16 +94,6 @@ def _setup_logging(log_level: str, log_format: str) -> None:
     root.setLevel(level)
 
 
-def _metis_health_url(detect_url: str) -> str:
-    parsed = urlsplit(detect_url)
-    path = parsed.path
-    if path.endswith("/detect"):
-        path = f"{path.rsplit('/', 1)[0]}/healthz"
-    else:
-        path = "/healthz"
-    return urlunsplit((parsed.scheme, parsed.netloc, path, "", ""))
-
-
 def _is_http_up(url: str, timeout: float = 2.0) -> bool:
     try:
         response = requests.get(url, timeout=timeout)
@@ -126,13 +129,16 @@ def _start_health_server(port: int, readiness: ReadinessState) -> None:
     threading.Thread(target=server.serve_forever, daemon=True, name="health-server").start()
 
 
-def _start_dependency_probe(config: AppConfig, readiness: ReadinessState) -> None:
+def _start_dependency_probe(
+    config: AppConfig,
+    readiness: ReadinessState,
+    metis: MetisClient | UdsMetisClient,
+) -> None:
     def _probe_loop() -> None:
         frigate_url = f"{config.frigate_base_url.rstrip('/')}/api/version"
-        metis_url = _metis_health_url(config.metis_detector_url)
         while True:
             frigate_ok = _is_http_up(frigate_url)
-            metis_ok = _is_http_up(metis_url)
+            metis_ok = metis.is_up()
             readiness.details = {"frigate": frigate_ok, "metis_detector": metis_ok}
             readiness.ready = frigate_ok and metis_ok
             time.sleep(5)
@@ -140,101 +146,54 @@ def _start_dependency_probe(config: AppConfig, readiness: ReadinessState) -> Non
     threading.Thread(target=_probe_loop, daemon=True, name="dependency-probe").start()
 
 
-def _default_zone_class_ids() -> dict[str, dict[str, int]]:
-    return {
-        "garage": {"open": 0, "closed": 1},
-        "gate": {"open": 2, "closed": 3},
-        "latch": {"open": 4, "closed": 5},
-    }
-
-
-def _jpg_bytes(frame: np.ndarray) -> bytes:
-    ok, encoded = cv2.imencode(".jpg", frame)
-    if not ok:
-        raise RuntimeError("Failed to JPEG encode frame")
-    return encoded.tobytes()
-
-
-def _call_metis(metis_url: str, roi_frame: np.ndarray, timeout: float = 1.0) -> list[list[float]]:
-    payload = _jpg_bytes(roi_frame)
-    start = time.time()
-    resp = requests.post(
-        metis_url,
-        data=payload,
-        headers={"Content-Type": "image/jpeg"},
-        timeout=timeout,
-    )
-    elapsed_ms = (time.time() - start) * 1000.0
-    INFER_MS.observe(elapsed_ms)
-    resp.raise_for_status()
-    data = resp.json()
-    if not isinstance(data, list):
-        return []
-    return data
-
-
-def _zone_state_from_detections(
-    detections: list[list[float]],
-    class_ids: dict[str, int],
-    conf_threshold: float = 0.5,
-) -> tuple[ZoneState, float]:
-    best_open = 0.0
-    best_closed = 0.0
-    open_cls = class_ids["open"]
-    closed_cls = class_ids["closed"]
-    for det in detections:
-        if len(det) < 6:
-            continue
-        cls_id = int(det[0])
-        score = float(det[1])
-        if cls_id == open_cls:
-            best_open = max(best_open, score)
-        elif cls_id == closed_cls:
-            best_closed = max(best_closed, score)
-
-    if best_open < conf_threshold and best_closed < conf_threshold:
-        return ZoneState.UNKNOWN, 0.0
-    if best_open >= best_closed:
-        return ZoneState.OPEN, best_open
-    return ZoneState.CLOSED, best_closed
-
-
-def _put_latest(camera_runtime: CameraRuntime, frame: np.ndarray, ts: float) -> None:
-    q = camera_runtime.queue
-    dropped = 0
-    while q.full():
-        try:
-            q.get_nowait()
-            dropped += 1
-        except queue.Empty:
-            break
-    if dropped:
-        DROPPED_SAMPLES.labels(camera=camera_runtime.camera.name).inc(dropped)
-    q.put_nowait((frame, ts))
-    QUEUE_DEPTH.labels(camera=camera_runtime.camera.name).set(q.qsize())
-
-
 def _sampler_worker(camera_runtime: CameraRuntime, sample_fps: float) -> None:
     camera = camera_runtime.camera
-    for frame, ts in sample_stream(camera.stream_url, sample_fps):
-        _put_latest(camera_runtime, frame, ts)
+    scheduler = camera_runtime.scheduler
+    while True:
+        frames = sample_stream(
+            camera.stream_url,
+            scheduler.max_fps if scheduler else sample_fps,
+            fps_fn=(lambda: scheduler.fps) if scheduler else None,
+            mode=camera.sampler,
+            camera=camera.name,
+            ffmpeg=camera.ffmpeg,
+            pool=camera_runtime.pool,
+        )
+        try:
+            for frame, ts in frames:
+                camera_runtime.mailbox.put(frame, ts)
+        except Exception:
+            LOGGER.exception("Sampler error camera=%s; restarting the stream", camera.name)
+            time.sleep(SAMPLER_RESTART_S)
+
+
+def _create_outbox(config: AppConfig) -> EventOutbox:
+    if config.execution_mode == "asyncio":
+        # Sends on the runtime's shared httpx client; run_async starts it on the event loop.
+        return AsyncEventOutbox(
+            spool_path=config.outbox_spool,
+            concurrency=config.outbox_concurrency,
+            max_age_s=config.outbox_max_age_s,
+        )
+    frigate = FrigateApi(config.frigate_base_url, pool_size=config.outbox_concurrency)
+    return EventOutbox(
+        frigate,
+        spool_path=config.outbox_spool,
+        concurrency=config.outbox_concurrency,
+        max_age_s=config.outbox_max_age_s,
+    )
 
 
-def _emit_event(
-    frigate: FrigateApi,
-    camera_name: str,
-    label: str,
-    score: float,
-    duration: int,
-    extra: str,
-) -> None:
-    SEMANTIC_EVENTS.labels(camera=camera_name, type=label).inc()
-    sub_label = f"{extra} conf={score:.2f} source=metis"
-    frigate.create_event(camera=camera_name, label=label, sub_label=sub_label, score=score, duration=duration)
+def _start_mqtt(config: AppConfig) -> MqttPublisher | None:
+    if not config.mqtt_broker:
+        return None
+    publisher = MqttPublisher(create_mqtt_client(), prefix=config.mqtt_topic_prefix)
+    publisher.start(*parse_broker(config.mqtt_broker))
+    register_mqtt(publisher)
+    return publisher
 
 
-def _camera_worker(config: AppConfig, camera_runtime: CameraRuntime, frigate: FrigateApi) -> None:
-    camera = camera_runtime.camera
+def _build_runtime(config: AppConfig, camera: CameraConfig, pool: FramePool, ctx=None) -> CameraRuntime:
     left_open_seconds = float(config.left_open_minutes) * 60.0
     machines = {
         zone: DebouncedStateMachine(
@@ -249,63 +208,160 @@ def _camera_worker(config: AppConfig, camera_runtime: CameraRuntime, frigate: Fr
         for zone in camera.rois.keys()
         if zone in ZONE_SPECS
     }
+    scheduler = None
+    if config.adaptive_sampling:
+        if camera.sampler == "read":
+            # read() decodes only when sampled, so at idle rates OpenCV's buffer hands back stale frames.
+            LOGGER.warning(
+                "ADAPTIVE_SAMPLING with sampler=read may process stale frames camera=%s; use grab or ffmpeg", camera.name
+            )
+        rates = {zone: ZoneRates(**ZONE_SPECS[zone]["sampling"]) for zone in machines}
+        scheduler = SamplingScheduler(camera.name, machines, rates, default_fps=config.sample_fps)
+    depth = camera.queue_max or config.queue_max
+    max_age_s = config.max_frame_age_s if camera.max_frame_age_s is None else camera.max_frame_age_s
+    if config.execution_mode == "asyncio":
+        mailbox = AsyncLatestMailbox(depth=depth, max_age_s=max_age_s, release=pool.release)
+    elif ctx is None:
+        mailbox = LatestMailbox(depth=depth, max_age_s=max_age_s, release=pool.release)
+    else:
+        # Process mode: the shared-memory ring is both the sampler's frame pool and the worker's mailbox.
+        budget = config.frame_pool_bytes // max(1, len(config.cameras))
+        mailbox = pool = SharedFrameRing(camera.name, depth, max_age_s, budget, ctx)
+    return CameraRuntime(
+        camera=camera,
+        mailbox=mailbox,
+        pool=pool,
+        machines=machines,
+        scheduler=scheduler,
+    )
 
-    class_map = _default_zone_class_ids()
 
+def _camera_worker(
+    config: AppConfig,
+    camera_runtime: CameraRuntime,
+    events: Notifier,
+    metis: MetisClient | UdsMetisClient,
+) -> None:
+    pipeline = ZonePipeline(config, camera_runtime)
     while True:
-        frame, sampled_ts = camera_runtime.queue.get()
-        QUEUE_DEPTH.labels(camera=camera.name).set(camera_runtime.queue.qsize())
-        now = time.time()
-
-        for zone, roi in camera.rois.items():
-            machine = machines.get(zone)
-            ids = class_map.get(zone)
-            if machine is None or ids is None:
-                continue
+        frame, sampled_ts = camera_runtime.mailbox.get()
+        try:
+            _process_frame(pipeline, camera_runtime, events, metis, frame, sampled_ts)
+        except Exception:
+            # A bad frame is logged and skipped; it must not stop the camera.
+            LOGGER.exception("Frame error camera=%s", camera_runtime.camera.name)
+
+
+def _process_frame(
+    pipeline: ZonePipeline,
+    camera_runtime: CameraRuntime,
+    events: Notifier,
+    metis: MetisClient | UdsMetisClient,
+    frame,
+    sampled_ts: float,
+) -> None:
+    camera = camera_runtime.camera
+    now = time.time()
+    try:
+        work = pipeline.start(frame, now)
+        if work is not None and work.pending:
             try:
-                roi_frame = crop_roi(frame, roi)
-                detections = _call_metis(config.metis_detector_url, roi_frame)
-                observed, score = _zone_state_from_detections(detections, ids)
+                results = call_metis(metis, *pipeline.inputs(work))
+                pipeline.observe(work, results, now)
             except Exception as exc:
-                LOGGER.warning("Inference error camera=%s zone=%s err=%s", camera.name, zone, exc)
-                observed, score = ZoneState.UNKNOWN, 0.0
-
-            out = machine.update(observed, now)
-            if out.transition_event:
-                _emit_event(
-                    frigate,
-                    camera_name=camera.name,
-                    label=out.transition_event,
-                    score=score,
-                    duration=15,
-                    extra=f"zone={zone} state={observed.value}",
-                )
-            if out.left_open_event:
-                _emit_event(
-                    frigate,
-                    camera_name=camera.name,
-                    label=out.left_open_event,
-                    score=max(0.5, score),
-                    duration=30,
-                    extra=f"zone={zone} open_for={config.left_open_minutes}m",
-                )
-
-        e2e_ms = (time.time() - sampled_ts) * 1000.0
-        E2E_MS.observe(e2e_ms)
+                LOGGER.warning("Inference error camera=%s zones=%s err=%s", camera.name, work.pending, exc)
+    finally:
+        camera_runtime.pool.release(frame)
+    if work is None:
+        return
+
+    for event in pipeline.finish(work, now):
+        emit_zone_event(events, camera.name, event)
+    for update in pipeline.states(work, now):
+        events.put(update)
+
+    e2e_ms = (time.time() - sampled_ts) * 1000.0
+    E2E_MS.observe(e2e_ms)
+
+
+def _worker_process(config: AppConfig, runtimes: list[CameraRuntime], events) -> None:
+    # The detector client is created after the fork so no connection is shared with the parent.
+    metis = create_metis_client(config)
+    threads = [
+        threading.Thread(
+            target=_camera_worker,
+            args=(config, runtime, events, metis),
+            daemon=True,
+            name=f"worker-{runtime.camera.name}",
+        )
+        for runtime in runtimes
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def _start_worker_processes(config: AppConfig, runtimes: list[CameraRuntime], ctx, events) -> list:
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        LOGGER.warning("PROMETHEUS_MULTIPROC_DIR is not set; metrics from worker processes will not be exported")
+    count = min(config.worker_processes or os.cpu_count() or 1, len(runtimes))
+    # Started before forking so every process shares one tracker and only the parent unlinks segments.
+    resource_tracker.ensure_running()
+    processes = []
+    for index in range(count):
+        process = ctx.Process(
+            target=_worker_process,
+            args=(config, runtimes[index::count], events),
+            daemon=True,
+            name=f"camera-workers-{index}",
+        )
+        process.start()
+        processes.append(process)
+    return processes
 
 
 def run() -> None:
     config = load_config()
     _setup_logging(log_level=config.log_level, log_format=config.log_format)
+
+    ctx = multiprocessing.get_context("fork") if config.execution_mode == "processes" else None
+    pool = FramePool(config.frame_pool_bytes)
+    runtimes = [_build_runtime(config, camera, pool, ctx) for camera in config.cameras]
+    # Worker processes are forked before this process starts any thread. They hand their events and
+    # zone states to the main process's notifier over a queue.
+    queue = ctx.Queue() if ctx is not None else None
+    processes = _start_worker_processes(config, runtimes, ctx, queue) if ctx is not None else []
+
     readiness = ReadinessState()
     _start_health_server(config.health_port, readiness)
-    _start_dependency_probe(config, readiness)
+    register_frame_pools(list({id(runtime.pool): runtime.pool for runtime in runtimes}.values()))
+    register_mailboxes({runtime.camera.name: runtime.mailbox for runtime in runtimes})
+    outbox = _create_outbox(config)
+    if not isinstance(outbox, AsyncEventOutbox):
+        outbox.start()
+    register_outbox(outbox)
+    events = Notifier(outbox, _start_mqtt(config))
+    if queue is not None:
+        threading.Thread(target=events.forward, args=(queue,), daemon=True, name="event-forwarder").start()
     start_metrics_server(config.metrics_port)
-    frigate = FrigateApi(config.frigate_base_url)
+    metis = create_metis_client(config)
+    _start_dependency_probe(config, readiness, metis)
 
-    runtimes: list[CameraRuntime] = []
-    for camera in config.cameras:
-        runtimes.append(CameraRuntime(camera=camera, queue=queue.Queue(maxsize=config.queue_max)))
+    LOGGER.info(
+        "safehaven-core started cameras=%s execution_mode=%s worker_processes=%s metrics_port=%s "
+        "health_port=%s log_format=%s pid=%s",
+        [c.name for c in config.cameras],
+        config.execution_mode,
+        len(processes),
+        config.metrics_port,
+        config.health_port,
+        config.log_format,
+        os.getpid(),
+    )
+    if config.execution_mode == "asyncio":
+        run_async(config, runtimes, events)
+        return
 
     for runtime in runtimes:
         threading.Thread(
@@ -315,23 +371,24 @@ def run() -> None:
             name=f"sampler-{runtime.camera.name}",
         ).start()
 
-    for runtime in runtimes:
-        threading.Thread(
-            target=_camera_worker,
-            args=(config, runtime, frigate),
-            daemon=True,
-            name=f"worker-{runtime.camera.name}",
-        ).start()
+    if not processes:
+        for runtime in runtimes:
+            threading.Thread(
+                target=_camera_worker,
+                args=(config, runtime, events, metis),
+                daemon=True,
+                name=f"worker-{runtime.camera.name}",
+            ).start()
 
-    LOGGER.info(
-        "safehaven-core started cameras=%s metrics_port=%s health_port=%s log_format=%s pid=%s",
-        [c.name for c in config.cameras],
-        config.metrics_port,
-        config.health_port,
-        config.log_format,
-        os.getpid(),
-    )
     while True:
+        for process in processes:
+            if not process.is_alive():
+                # Exit so the container restarts with a fresh set of workers and shared-memory rings.
+                mark_process_dead(process.pid)
+                LOGGER.error("Worker process exited name=%s code=%s", process.name, process.exitcode)
+                for runtime in runtimes:
+                    runtime.pool.close()
+                sys.exit(1)
         time.sleep(1)
 
 
@@ -0,0 +1,558 @@
+import asyncio
+import itertools
+import logging
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+from .config import AppConfig
+from .metrics import INFER_MS, METIS_CONNECTIONS_OPENED, METIS_REQUESTS, METIS_SHED
+from .preprocess import Letterbox
+
+LOGGER = logging.getLogger(__name__)
+
+TENSOR_CONTENT_TYPE = "application/x-safehaven-tensor"
+
+# Must match UDS_REQUEST / UDS_RESPONSE in metis-detector/app.py.
+UDS_REQUEST = struct.Struct("<IBBHHHI")
+UDS_RESPONSE = struct.Struct("<IHHI")
+UDS_KIND_JPEG = 1
+UDS_KIND_TENSOR = 2
+UDS_FLAG_BGR = 1
+# With this flag the payload starts with the letterbox as four little-endian float32 fractions.
+UDS_FLAG_LETTERBOX = 2
+UDS_LETTERBOX = struct.Struct("<4f")
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def __init__(self, *args, pool_timeout: float | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_timeout = pool_timeout
+
+    def _new_conn(self):
+        METIS_CONNECTIONS_OPENED.labels(endpoint=f"{self.host}:{self.port}").inc()
+        return super()._new_conn()
+
+    def urlopen(self, method, url, *args, **kwargs):
+        METIS_REQUESTS.labels(endpoint=f"{self.host}:{self.port}").inc()
+        # requests never passes pool_timeout, which leaves a blocking pool waiting forever.
+        kwargs.setdefault("pool_timeout", self.pool_timeout)
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def __init__(self, *args, pool_timeout: float | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_timeout = pool_timeout
+
+    def _new_conn(self):
+        METIS_CONNECTIONS_OPENED.labels(endpoint=f"{self.host}:{self.port}").inc()
+        return super()._new_conn()
+
+    def urlopen(self, method, url, *args, **kwargs):
+        METIS_REQUESTS.labels(endpoint=f"{self.host}:{self.port}").inc()
+        # requests never passes pool_timeout, which leaves a blocking pool waiting forever.
+        kwargs.setdefault("pool_timeout", self.pool_timeout)
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class _PooledAdapter(HTTPAdapter):
+    # pool_timeout bounds the wait for a free connection when the pool blocks; EmptyPoolError after that.
+    def __init__(self, *args, pool_timeout: float | None = None, **kwargs) -> None:
+        self.pool_timeout = pool_timeout
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": partial(_CountingHTTPConnectionPool, pool_timeout=self.pool_timeout),
+            "https": partial(_CountingHTTPSConnectionPool, pool_timeout=self.pool_timeout),
+        }
+
+
+def metis_health_url(detect_url: str) -> str:
+    parsed = urlsplit(detect_url)
+    path = parsed.path
+    if path.endswith("/detect"):
+        path = f"{path.rsplit('/', 1)[0]}/healthz"
+    else:
+        path = "/healthz"
+    return urlunsplit((parsed.scheme, parsed.netloc, path, "", ""))
+
+
+def metis_batch_url(detect_url: str) -> str:
+    parsed = urlsplit(detect_url)
+    path = parsed.path.rstrip("/") or "/detect"
+    return urlunsplit((parsed.scheme, parsed.netloc, f"{path}_batch", parsed.query, ""))
+
+
+def is_local_endpoint(url: str) -> bool:
+    host = urlsplit(url).hostname
+    if not host:
+        return False
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except OSError:
+        return False
+    local = {"::1"}
+    try:
+        local.update(socket.gethostbyname_ex(socket.gethostname())[2])
+    except OSError:
+        pass
+    return any(addr.startswith("127.") or addr in local for addr in addresses)
+
+
+def letterbox_headers(letterboxes: list[Letterbox | None] | None) -> dict[str, str]:
+    # X-Letterbox lists one "x0,y0,x1,y1" per image (empty for images sent as-is), so the detector
+    # can map boxes from the padded model input back to the original crop.
+    if not letterboxes or all(letterbox is None for letterbox in letterboxes):
+        return {}
+    return {
+        "X-Letterbox": ";".join(
+            "" if letterbox is None else ",".join(f"{value:.6f}" for value in letterbox) for letterbox in letterboxes
+        )
+    }
+
+
+class MetisBusyError(RuntimeError):
+    pass
+
+
+def _retry_after_seconds(value: str | None, default: float = 1.0) -> float:
+    try:
+        return max(0.0, float(value)) if value else default
+    except ValueError:
+        return default
+
+
+class MetisClient:
+    def __init__(
+        self,
+        detect_url: str,
+        pool_size: int = 8,
+        timeout: float = 1.0,
+        connect_timeout: float = 0.5,
+        transport: str = "auto",
+    ) -> None:
+        self.detect_url = detect_url
+        self.health_url = metis_health_url(detect_url)
+        self.batch_url = metis_batch_url(detect_url)
+        self._batch_supported = True
+        self._busy_until = 0.0
+        # Raw tensors skip JPEG encode/decode; only worth it when the bytes never leave the host.
+        self.raw_tensors = transport == "tensor" or (transport == "auto" and is_local_endpoint(detect_url))
+        self.timeout = (connect_timeout, timeout)
+        self.session = requests.Session()
+        # pool_block caps sockets per endpoint at pool_size; extra callers wait for a free one, for at
+        # most the read timeout, and are then treated as if the detector were busy.
+        adapter = _PooledAdapter(
+            pool_connections=1, pool_maxsize=max(1, pool_size), pool_block=True, pool_timeout=timeout
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def detect(
+        self,
+        payload: bytes,
+        content_type: str = "image/jpeg",
+        headers: dict[str, str] | None = None,
+    ) -> list[list[float]]:
+        resp = self._post(self.detect_url, payload, {"Content-Type": content_type, **(headers or {})})
+        resp.raise_for_status()
+        data = resp.json()
+        if not isinstance(data, list):
+            return []
+        return data
+
+    def detect_batch(
+        self,
+        payloads: list[bytes],
+        content_type: str = "image/jpeg",
+        letterboxes: list[Letterbox | None] | None = None,
+    ) -> list[list[list[float]]]:
+        if not payloads:
+            return []
+        letterboxes = letterboxes or [None] * len(payloads)
+        if len(payloads) > 1 and self._batch_supported:
+            headers = {
+                "Content-Type": content_type,
+                "X-Batch-Sizes": ",".join(str(len(payload)) for payload in payloads),
+                **letterbox_headers(letterboxes),
+            }
+            results = self._post_batch(payloads, headers)
+            if results is not None:
+                return results
+        return [
+            self.detect(payload, content_type, headers=letterbox_headers([letterbox]))
+            for payload, letterbox in zip(payloads, letterboxes)
+        ]
+
+    def detect_tensors(
+        self,
+        frames: list[np.ndarray],
+        letterboxes: list[Letterbox | None] | None = None,
+    ) -> list[list[list[float]]]:
+        letterboxes = letterboxes or [None] * len(frames)
+        arrays = [np.ascontiguousarray(frame, dtype=np.uint8) for frame in frames]
+        # Flat views so len() on the request body is the byte count, not the row count.
+        buffers = [array.reshape(-1).data for array in arrays]
+        shapes = [",".join(str(dim) for dim in array.shape) for array in arrays]
+        try:
+            if len(arrays) > 1 and self._batch_supported:
+                headers = {
+                    "Content-Type": TENSOR_CONTENT_TYPE,
+                    "X-Tensor-Shape": ";".join(shapes),
+                    "X-Tensor-Order": "bgr",
+                    **letterbox_headers(letterboxes),
+                }
+                results = self._post_batch(buffers, headers)
+                if results is not None:
+                    return results
+            return [
+                self.detect(
+                    buffer,
+                    TENSOR_CONTENT_TYPE,
+                    headers={"X-Tensor-Shape": shape, "X-Tensor-Order": "bgr", **letterbox_headers([letterbox])},
+                )
+                for buffer, shape, letterbox in zip(buffers, shapes, letterboxes)
+            ]
+        except requests.HTTPError as exc:
+            if exc.response is not None and exc.response.status_code == 415:
+                LOGGER.warning("metis-detector does not accept raw tensors, switching to JPEG")
+                self.raw_tensors = False
+            raise
+
+    def is_up(self, timeout: float = 2.0) -> bool:
+        try:
+            return self.session.get(self.health_url, timeout=timeout).status_code < 500
+        except requests.RequestException:
+            return False
+
+    def _post_batch(self, payloads: list, headers: dict[str, str]) -> list[list[list[float]]] | None:
+        resp = self._post(self.batch_url, b"".join(payloads), headers)
+        if resp.status_code in (404, 405):
+            LOGGER.warning("metis-detector has no %s, falling back to per-zone /detect", self.batch_url)
+            self._batch_supported = False
+            return None
+        resp.raise_for_status()
+        data = resp.json()
+        if not isinstance(data, list) or len(data) != len(payloads):
+            raise ValueError(f"Batch response has {len(data) if isinstance(data, list) else 0} results for {len(payloads)} images")
+        return [item if isinstance(item, list) else [] for item in data]
+
+    def _post(self, url: str, payload, headers: dict[str, str]) -> requests.Response:
+        # While the detector has asked us to back off, fail locally instead of queueing on it.
+        if time.monotonic() < self._busy_until:
+            METIS_SHED.inc()
+            raise MetisBusyError("metis-detector is saturated, backing off")
+
+        start = time.time()
+        try:
+            resp = self.session.post(url, data=payload, headers=headers, timeout=self.timeout)
+        except EmptyPoolError as exc:
+            METIS_SHED.inc()
+            raise MetisBusyError("every connection to metis-detector is in use") from exc
+        elapsed_ms = (time.time() - start) * 1000.0
+        INFER_MS.observe(elapsed_ms)
+        if resp.status_code in (429, 503):
+            self._busy_until = time.monotonic() + _retry_after_seconds(resp.headers.get("Retry-After"))
+            raise MetisBusyError(f"metis-detector returned {resp.status_code}")
+        return resp
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncMetisClient:
+    # asyncio counterpart of MetisClient. Shares one httpx.AsyncClient with the rest of the asyncio
+    # runtime; the semaphore caps in-flight detector calls at pool_size.
+    def __init__(self, client: httpx.AsyncClient, detect_url: str, pool_size: int = 8, transport: str = "auto") -> None:
+        self.client = client
+        self.detect_url = detect_url
+        self.batch_url = metis_batch_url(detect_url)
+        self._batch_supported = True
+        self._busy_until = 0.0
+        self.raw_tensors = transport == "tensor" or (transport == "auto" and is_local_endpoint(detect_url))
+        self._slots = asyncio.Semaphore(max(1, pool_size))
+        parsed = urlsplit(detect_url)
+        self._endpoint = f"{parsed.hostname}:{parsed.port or (443 if parsed.scheme == 'https' else 80)}"
+
+    async def detect(
+        self,
+        payload: bytes,
+        content_type: str = "image/jpeg",
+        headers: dict[str, str] | None = None,
+    ) -> list[list[float]]:
+        resp = await self._post(self.detect_url, payload, {"Content-Type": content_type, **(headers or {})})
+        resp.raise_for_status()
+        data = resp.json()
+        if not isinstance(data, list):
+            return []
+        return data
+
+    async def detect_batch(
+        self,
+        payloads: list[bytes],
+        content_type: str = "image/jpeg",
+        letterboxes: list[Letterbox | None] | None = None,
+    ) -> list[list[list[float]]]:
+        if not payloads:
+            return []
+        letterboxes = letterboxes or [None] * len(payloads)
+        if len(payloads) > 1 and self._batch_supported:
+            headers = {
+                "Content-Type": content_type,
+                "X-Batch-Sizes": ",".join(str(len(payload)) for payload in payloads),
+                **letterbox_headers(letterboxes),
+            }
+            results = await self._post_batch(payloads, headers)
+            if results is not None:
+                return results
+        return [
+            await self.detect(payload, content_type, headers=letterbox_headers([letterbox]))
+            for payload, letterbox in zip(payloads, letterboxes)
+        ]
+
+    async def detect_tensors(
+        self,
+        frames: list[np.ndarray],
+        letterboxes: list[Letterbox | None] | None = None,
+    ) -> list[list[list[float]]]:
+        letterboxes = letterboxes or [None] * len(frames)
+        arrays = [np.ascontiguousarray(frame, dtype=np.uint8) for frame in frames]
+        shapes = [",".join(str(dim) for dim in array.shape) for array in arrays]
+        try:
+            if len(arrays) > 1 and self._batch_supported:
+                headers = {
+                    "Content-Type": TENSOR_CONTENT_TYPE,
+                    "X-Tensor-Shape": ";".join(shapes),
+                    "X-Tensor-Order": "bgr",
+                    **letterbox_headers(letterboxes),
+                }
+                results = await self._post_batch([array.tobytes() for array in arrays], headers)
+                if results is not None:
+                    return results
+            return [
+                await self.detect(
+                    array.tobytes(),
+                    TENSOR_CONTENT_TYPE,
+                    headers={"X-Tensor-Shape": shape, "X-Tensor-Order": "bgr", **letterbox_headers([letterbox])},
+                )
+                for array, shape, letterbox in zip(arrays, shapes, letterboxes)
+            ]
+        except httpx.HTTPStatusError as exc:
+            if exc.response.status_code == 415:
+                LOGGER.warning("metis-detector does not accept raw tensors, switching to JPEG")
+                self.raw_tensors = False
+            raise
+
+    async def _post_batch(self, payloads: list[bytes], headers: dict[str, str]) -> list[list[list[float]]] | None:
+        resp = await self._post(self.batch_url, b"".join(payloads), headers)
+        if resp.status_code in (404, 405):
+            LOGGER.warning("metis-detector has no %s, falling back to per-zone /detect", self.batch_url)
+            self._batch_supported = False
+            return None
+        resp.raise_for_status()
+        data = resp.json()
+        if not isinstance(data, list) or len(data) != len(payloads):
+            raise ValueError(f"Batch response has {len(data) if isinstance(data, list) else 0} results for {len(payloads)} images")
+        return [item if isinstance(item, list) else [] for item in data]
+
+    async def _post(self, url: str, payload: bytes, headers: dict[str, str]) -> httpx.Response:
+        if time.monotonic() < self._busy_until:
+            METIS_SHED.inc()
+            raise MetisBusyError("metis-detector is saturated, backing off")
+
+        async with self._slots:
+            METIS_REQUESTS.labels(endpoint=self._endpoint).inc()
+            start = time.time()
+            resp = await self.client.post(url, content=payload, headers=headers, extensions={"trace": self._trace})
+            INFER_MS.observe((time.time() - start) * 1000.0)
+        if resp.status_code in (429, 503):
+            self._busy_until = time.monotonic() + _retry_after_seconds(resp.headers.get("Retry-After"))
+            raise MetisBusyError(f"metis-detector returned {resp.status_code}")
+        return resp
+
+    async def _trace(self, event_name: str, _info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            METIS_CONNECTIONS_OPENED.labels(endpoint=self._endpoint).inc()
+
+
+class UdsMetisClient:
+    # One persistent Unix-socket connection shared by every camera worker. Requests carry an
+    # id, so many can be in flight at once; a reader thread routes each answer to its caller.
+    raw_tensors = True
+
+    def __init__(self, socket_path: str, timeout: float = 1.0, connect_timeout: float = 0.5) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._sock: socket.socket | None = None
+        self._conn_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending: dict[int, Future] = {}
+        self._ids = itertools.count(1)
+        self._busy_until = 0.0
+
+    def detect_batch(
+        self,
+        payloads: list[bytes],
+        content_type: str = "image/jpeg",
+        letterboxes: list[Letterbox | None] | None = None,
+    ) -> list[list[list[float]]]:
+        letterboxes = letterboxes or [None] * len(payloads)
+        return self._round_trip(
+            [(UDS_KIND_JPEG, 0, (0, 0, 0), payload, letterbox) for payload, letterbox in zip(payloads, letterboxes)]
+        )
+
+    def detect_tensors(
+        self,
+        frames: list[np.ndarray],
+        letterboxes: list[Letterbox | None] | None = None,
+    ) -> list[list[list[float]]]:
+        letterboxes = letterboxes or [None] * len(frames)
+        items = []
+        for frame, letterbox in zip(frames, letterboxes):
+            array = np.ascontiguousarray(frame, dtype=np.uint8)
+            shape = array.shape if array.ndim == 3 else (*array.shape, 0)
+            items.append((UDS_KIND_TENSOR, UDS_FLAG_BGR, shape, array.reshape(-1).data, letterbox))
+        return self._round_trip(items)
+
+    def is_up(self, timeout: float = 2.0) -> bool:
+        try:
+            self._connection()
+            return True
+        except OSError:
+            return False
+
+    def close(self) -> None:
+        with self._conn_lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+    def _round_trip(self, items: list[tuple]) -> list[list[list[float]]]:
+        if not items:
+            return []
+        if time.monotonic() < self._busy_until:
+            METIS_SHED.inc()
+            raise MetisBusyError("metis-detector is saturated, backing off")
+
+        start = time.time()
+        futures = [self._submit(*item) for item in items]
+        deadline = time.monotonic() + self.timeout
+        try:
+            results = [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+        INFER_MS.observe((time.time() - start) * 1000.0)
+        return results
+
+    def _submit(self, kind: int, flags: int, shape: tuple, payload, letterbox: Letterbox | None = None) -> Future:
+        sock = self._connection()
+        request_id = next(self._ids) & 0xFFFFFFFF
+        future: Future = Future()
+        future.add_done_callback(lambda _f, rid=request_id: self._pending.pop(rid, None))
+        self._pending[request_id] = future
+        prefix = b""
+        if letterbox is not None:
+            flags |= UDS_FLAG_LETTERBOX
+            prefix = UDS_LETTERBOX.pack(*letterbox)
+        header = UDS_REQUEST.pack(request_id, kind, flags, shape[0], shape[1], shape[2], len(prefix) + len(payload))
+        METIS_REQUESTS.labels(endpoint=self.socket_path).inc()
+        try:
+            with self._send_lock:
+                sock.sendall(header + prefix)
+                sock.sendall(payload)
+        except OSError:
+            self._drop(sock)
+            raise
+        return future
+
+    def _connection(self) -> socket.socket:
+        with self._conn_lock:
+            if self._sock is not None:
+                return self._sock
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.connect_timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            sock.settimeout(None)
+            METIS_CONNECTIONS_OPENED.labels(endpoint=self.socket_path).inc()
+            self._sock = sock
+            threading.Thread(target=self._reader, args=(sock,), daemon=True, name="metis-uds-reader").start()
+            return sock
+
+    def _reader(self, sock: socket.socket) -> None:
+        try:
+            while True:
+                request_id, status, retry_after, length = UDS_RESPONSE.unpack(_recv_exact(sock, UDS_RESPONSE.size))
+                body = _recv_exact(sock, length)
+                future = self._pending.pop(request_id, None)
+                if future is None or not future.set_running_or_notify_cancel():
+                    continue
+                if status == 200:
+                    future.set_result(np.frombuffer(body, dtype="<f4").reshape(-1, 6).tolist())
+                elif status in (429, 503):
+                    self._busy_until = time.monotonic() + (retry_after or 1.0)
+                    future.set_exception(MetisBusyError(f"metis-detector returned {status}"))
+                else:
+                    future.set_exception(RuntimeError(f"metis-detector returned {status}: {body.decode('utf-8', 'replace')}"))
+        except OSError as exc:
+            LOGGER.warning("metis unix socket closed path=%s err=%s", self.socket_path, exc)
+        finally:
+            self._drop(sock)
+
+    def _drop(self, sock: socket.socket) -> None:
+        with self._conn_lock:
+            if self._sock is sock:
+                self._sock = None
+        sock.close()
+        for request_id in list(self._pending):
+            future = self._pending.pop(request_id, None)
+            if future is not None and future.set_running_or_notify_cancel():
+                future.set_exception(ConnectionError("metis unix socket closed"))
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("connection closed by metis-detector")
+        received += count
+    return bytes(buf)
+
+
+def create_metis_client(config: AppConfig) -> MetisClient | UdsMetisClient:
+    parsed = urlsplit(config.metis_detector_url)
+    if parsed.scheme == "unix":
+        return UdsMetisClient(
+            parsed.path,
+            timeout=config.metis_timeout,
+            connect_timeout=config.metis_connect_timeout,
+        )
+    return MetisClient(
+        config.metis_detector_url,
+        pool_size=config.metis_pool_size,
+        timeout=config.metis_timeout,
+        connect_timeout=config.metis_connect_timeout,
+        transport=config.metis_transport,
+    )
@@ -1,4 +1,24 @@
-from prometheus_client import Counter, Gauge, Histogram, start_http_server
+import os
+
+# prometheus_client switches to multiprocess mode when the variable merely exists, and an empty value
+# would make every process write its metric files into the working directory. Compose passes an
+# empty value to mean "not set", so treat it that way.
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR", "x"):
+    del os.environ["PROMETHEUS_MULTIPROC_DIR"]
+
+from prometheus_client import (  # noqa: E402
+    GC_COLLECTOR,
+    PLATFORM_COLLECTOR,
+    PROCESS_COLLECTOR,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily  # noqa: E402
 
 INFER_MS = Histogram(
     "safehaven_infer_ms",
@@ -10,10 +30,185 @@ E2E_MS = Histogram(
     "End-to-end latency in milliseconds",
     buckets=(5, 10, 20, 50, 100, 200, 500, 1000, 2000),
 )
-QUEUE_DEPTH = Gauge("safehaven_queue_depth", "Queue depth per camera", ["camera"])
-DROPPED_SAMPLES = Counter("safehaven_dropped_samples", "Dropped stale samples", ["camera"])
+FRAME_AGE_MS = Histogram(
+    "safehaven_frame_age_ms",
+    "Age of a sampled frame when handed to its camera worker, in milliseconds",
+    ["camera"],
+    buckets=(5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000),
+)
+SAMPLE_FPS = Gauge(
+    "safehaven_sample_fps",
+    "Current adaptive sampler rate per camera",
+    ["camera"],
+    multiprocess_mode="livemostrecent",
+)
 SEMANTIC_EVENTS = Counter("safehaven_semantic_events", "Semantic events emitted", ["camera", "type"])
+CHANGE_GATE = Counter(
+    "safehaven_change_gate",
+    "Per-zone change-gate lookups; hit reuses the cached observation, miss calls Metis",
+    ["camera", "zone", "result"],
+)
+METIS_REQUESTS = Counter("safehaven_metis_requests", "HTTP requests sent to metis-detector", ["endpoint"])
+METIS_CONNECTIONS_OPENED = Counter(
+    "safehaven_metis_connections_opened",
+    "New TCP connections opened to metis-detector",
+    ["endpoint"],
+)
+METIS_SHED = Counter(
+    "safehaven_metis_shed",
+    "Detector calls skipped while metis-detector asked for backoff or no pooled connection freed up in time",
+)
+OUTBOX_DELIVERY_MS = Histogram(
+    "safehaven_outbox_delivery_ms",
+    "Time from queueing a Frigate event to its successful delivery, in milliseconds",
+    buckets=(10, 50, 100, 500, 1000, 5000, 10000, 60000, 300000),
+)
+
+
+class MailboxCollector:
+    # Reads per-camera mailbox counters at scrape time, so the frame hot path never takes a metric lock.
+    def __init__(self, mailboxes: dict) -> None:
+        self.mailboxes = mailboxes
+
+    def collect(self):
+        depth = GaugeMetricFamily("safehaven_queue_depth", "Queue depth per camera", labels=["camera"])
+        dropped = CounterMetricFamily(
+            "safehaven_dropped_samples",
+            "Dropped stale samples",
+            labels=["camera", "reason"],
+        )
+        for camera, mailbox in self.mailboxes.items():
+            depth.add_metric([camera], mailbox.qsize())
+            dropped.add_metric([camera, "overwritten"], mailbox.overwritten)
+            dropped.add_metric([camera, "expired"], mailbox.expired)
+        yield depth
+        yield dropped
+
+
+class FramePoolCollector:
+    # Sums the shared frame pool, or the per-camera shared-memory rings in process mode.
+    def __init__(self, pools: list) -> None:
+        self.pools = pools
+
+    def collect(self):
+        occupancy = GaugeMetricFamily("safehaven_frame_pool_bytes", "Frame pool bytes by state", labels=["state"])
+        occupancy.add_metric(["in_use"], sum(pool.in_use_bytes for pool in self.pools))
+        occupancy.add_metric(["idle"], sum(pool.idle_bytes() for pool in self.pools))
+        yield occupancy
+        yield GaugeMetricFamily(
+            "safehaven_frame_pool_budget_bytes",
+            "Frame pool byte budget",
+            value=sum(pool.budget_bytes for pool in self.pools),
+        )
+        yield CounterMetricFamily(
+            "safehaven_frame_pool_allocations",
+            "Frame buffers allocated by the pool",
+            value=sum(pool.allocations for pool in self.pools),
+        )
+        yield CounterMetricFamily(
+            "safehaven_frame_pool_reuses",
+            "Frame buffers recycled by the pool",
+            value=sum(pool.reuses for pool in self.pools),
+        )
+        yield CounterMetricFamily(
+            "safehaven_frame_pool_exhausted",
+            "Frames skipped because the pool budget was exhausted",
+            value=sum(pool.exhausted for pool in self.pools),
+        )
+
+
+class OutboxCollector:
+    def __init__(self, outbox) -> None:
+        self.outbox = outbox
+
+    def collect(self):
+        yield GaugeMetricFamily(
+            "safehaven_outbox_depth",
+            "Frigate events queued or awaiting delivery",
+            value=self.outbox.depth(),
+        )
+        yield CounterMetricFamily(
+            "safehaven_outbox_delivered",
+            "Frigate events delivered",
+            value=self.outbox.delivered,
+        )
+        failures = CounterMetricFamily(
+            "safehaven_outbox_failures",
+            "Failed Frigate event deliveries: error is retried, rejected and expired are dropped",
+            labels=["reason"],
+        )
+        for reason, count in self.outbox.failures.items():
+            failures.add_metric([reason], count)
+        yield failures
+        yield GaugeMetricFamily(
+            "safehaven_outbox_spool_bytes",
+            "Size of the on-disk event spool",
+            value=self.outbox.spool_bytes,
+        )
+
+
+class MqttCollector:
+    def __init__(self, publisher) -> None:
+        self.publisher = publisher
+
+    def collect(self):
+        yield GaugeMetricFamily(
+            "safehaven_mqtt_connected",
+            "1 while connected to the MQTT broker",
+            value=int(self.publisher.connected),
+        )
+        yield GaugeMetricFamily(
+            "safehaven_mqtt_queue_depth",
+            "MQTT events and zone states waiting to be published",
+            value=self.publisher.depth(),
+        )
+        published = CounterMetricFamily("safehaven_mqtt_published", "MQTT messages published", labels=["kind"])
+        for kind, count in self.publisher.published.items():
+            published.add_metric([kind], count)
+        yield published
+        yield CounterMetricFamily(
+            "safehaven_mqtt_dropped",
+            "MQTT events dropped because the send queue was full",
+            value=self.publisher.dropped,
+        )
+
+
+def _scrape_registry() -> CollectorRegistry:
+    # With PROMETHEUS_MULTIPROC_DIR set (required for EXECUTION_MODE=processes) every process writes
+    # its values to files there and the parent's endpoint serves the aggregate.
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    # The default registry's process_* and python_* metrics, for the main process.
+    for collector in (PROCESS_COLLECTOR, PLATFORM_COLLECTOR, GC_COLLECTOR):
+        registry.register(collector)
+    return registry
+
+
+SCRAPE_REGISTRY = _scrape_registry()
+
+
+def register_mailboxes(mailboxes: dict) -> None:
+    SCRAPE_REGISTRY.register(MailboxCollector(mailboxes))
+
+
+def register_frame_pools(pools: list) -> None:
+    SCRAPE_REGISTRY.register(FramePoolCollector(pools))
+
+
+def register_outbox(outbox) -> None:
+    SCRAPE_REGISTRY.register(OutboxCollector(outbox))
+
+
+def register_mqtt(publisher) -> None:
+    SCRAPE_REGISTRY.register(MqttCollector(publisher))
+
+
+def mark_process_dead(pid: int) -> None:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
 
 
 def start_metrics_server(port: int) -> None:
-    start_http_server(port)
+    start_http_server(port, registry=SCRAPE_REGISTRY)
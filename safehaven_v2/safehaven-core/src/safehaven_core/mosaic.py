@@ -0,0 +1,86 @@
+import math
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Tile:
+    x: int
+    y: int
+    w: int
+    h: int
+
+
+class MosaicTiler:
+    # Packs a frame's zone crops into one size x size detector image on a grid. Each crop is scaled
+    # to fit its cell with its aspect ratio kept, so boxes map back to their zone by tile geometry
+    # alone. Layouts depend only on the crop sizes, which the camera's ROIs and stream size fix,
+    # so they are computed once per zone combination. The canvas is reused between frames.
+    def __init__(self, size: int = 640, pad: int = 114) -> None:
+        self.size = size
+        self.pad = pad
+        self._layouts: dict[tuple[tuple[int, int], ...], list[Tile]] = {}
+        self._canvas = np.full((size, size, 3), pad, dtype=np.uint8)
+
+    def layout(self, crops: list[np.ndarray]) -> list[Tile]:
+        key = tuple((int(crop.shape[0]), int(crop.shape[1])) for crop in crops)
+        tiles = self._layouts.get(key)
+        if tiles is None:
+            tiles = self._layouts[key] = self._grid(key)
+        return tiles
+
+    def compose(self, tiles: list[Tile], crops: list[np.ndarray]) -> np.ndarray:
+        canvas = self._canvas
+        canvas[:] = self.pad
+        for tile, crop in zip(tiles, crops):
+            canvas[tile.y : tile.y + tile.h, tile.x : tile.x + tile.w] = cv2.resize(
+                crop,
+                (tile.w, tile.h),
+                interpolation=cv2.INTER_AREA if tile.w < crop.shape[1] else cv2.INTER_LINEAR,
+            )
+        return canvas
+
+    def split(self, tiles: list[Tile], detections: list[list[float]]) -> list[list[list[float]]]:
+        # A box belongs to the tile containing its centre and is re-normalised to that tile;
+        # boxes centred on padding are dropped.
+        per_tile: list[list[list[float]]] = [[] for _ in tiles]
+        for det in detections:
+            if len(det) < 6:
+                continue
+            x1, y1, x2, y2 = (float(value) * self.size for value in det[2:6])
+            cx, cy = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+            for idx, tile in enumerate(tiles):
+                if tile.x <= cx < tile.x + tile.w and tile.y <= cy < tile.y + tile.h:
+                    per_tile[idx].append(
+                        [
+                            det[0],
+                            det[1],
+                            min(1.0, max(0.0, (x1 - tile.x) / tile.w)),
+                            min(1.0, max(0.0, (y1 - tile.y) / tile.h)),
+                            min(1.0, max(0.0, (x2 - tile.x) / tile.w)),
+                            min(1.0, max(0.0, (y2 - tile.y) / tile.h)),
+                        ]
+                    )
+                    break
+        return per_tile
+
+    def _grid(self, sizes: tuple[tuple[int, int], ...]) -> list[Tile]:
+        cols = math.ceil(math.sqrt(len(sizes)))
+        rows = math.ceil(len(sizes) / cols)
+        cell_w, cell_h = self.size // cols, self.size // rows
+        tiles = []
+        for idx, (h, w) in enumerate(sizes):
+            scale = min(cell_w / w, cell_h / h)
+            tile_w, tile_h = max(1, int(w * scale)), max(1, int(h * scale))
+            col, row = idx % cols, idx // cols
+            tiles.append(
+                Tile(
+                    x=col * cell_w + (cell_w - tile_w) // 2,
+                    y=row * cell_h + (cell_h - tile_h) // 2,
+                    w=tile_w,
+                    h=tile_h,
+                )
+            )
+        return tiles
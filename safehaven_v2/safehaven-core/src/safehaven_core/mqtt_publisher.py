@@ -0,0 +1,114 @@
+import json
+import logging
+import threading
+from collections import deque
+from dataclasses import asdict
+
+import paho.mqtt.client as mqtt
+
+from .event_outbox import OutboxEvent
+from .pipeline import ZoneStateUpdate
+
+LOGGER = logging.getLogger(__name__)
+
+
+def create_mqtt_client(client_id: str = "safehaven-core") -> mqtt.Client:
+    return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+
+
+def parse_broker(broker: str) -> tuple[str, int]:
+    # "host", "host:port" or "mqtt://host:port".
+    broker = broker.removeprefix("mqtt://").rstrip("/")
+    host, _, port = broker.rpartition(":") if ":" in broker else (broker, "", "")
+    return host, int(port or 1883)
+
+
+class MqttPublisher:
+    # One persistent broker connection; paho's network thread reconnects with backoff. Callers only
+    # touch in-memory queues: events go to a bounded deque (the oldest is dropped when full) and zone
+    # states to a dict keyed by camera and zone, so a newer state replaces one not yet sent. A sender
+    # thread publishes both while connected. States are retained and every known state is sent again
+    # after each (re)connect, so the broker holds the current state even if it lost its retained
+    # messages. The client is injectable for tests; anything with paho's Client interface works.
+    def __init__(
+        self,
+        client,
+        prefix: str = "safehaven",
+        queue_max: int = 1000,
+        qos: int = 1,
+    ) -> None:
+        self.client = client
+        self.prefix = prefix.rstrip("/")
+        self.qos = qos
+        self.connected = False
+        self.published = {"event": 0, "state": 0}
+        self.dropped = 0
+        self._events: deque[OutboxEvent] = deque(maxlen=max(1, queue_max))
+        self._states: dict[tuple[str, str], ZoneStateUpdate] = {}
+        self._dirty: dict[tuple[str, str], None] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    @property
+    def status_topic(self) -> str:
+        return f"{self.prefix}/status"
+
+    def start(self, host: str, port: int = 1883, keepalive: int = 30) -> None:
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.will_set(self.status_topic, "offline", qos=self.qos, retain=True)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+        self.client.connect_async(host, port, keepalive)
+        self.client.loop_start()
+        threading.Thread(target=self._run, daemon=True, name="mqtt-publisher").start()
+
+    def publish_event(self, event: OutboxEvent) -> None:
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(event)
+        self._wake.set()
+
+    def publish_state(self, update: ZoneStateUpdate) -> None:
+        key = (update.camera, update.zone)
+        with self._lock:
+            self._states[key] = update
+            self._dirty[key] = None
+        self._wake.set()
+
+    def depth(self) -> int:
+        return len(self._events) + len(self._dirty)
+
+    def _on_connect(self, client, _userdata, _flags, reason_code, _properties=None) -> None:
+        if reason_code.is_failure:
+            LOGGER.warning("MQTT connect refused reason=%s", reason_code)
+            return
+        client.publish(self.status_topic, "online", qos=self.qos, retain=True)
+        with self._lock:
+            self._dirty.update(dict.fromkeys(self._states))
+        self.connected = True
+        self._wake.set()
+        LOGGER.info("MQTT connected states=%s", len(self._states))
+
+    def _on_disconnect(self, _client, _userdata, _flags, reason_code, _properties=None) -> None:
+        self.connected = False
+        LOGGER.warning("MQTT disconnected reason=%s", reason_code)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while self.connected and self._events:
+                event = self._events.popleft()
+                payload = {key: value for key, value in asdict(event).items() if key != "id"}
+                self._publish(f"{self.prefix}/events/semantic", payload, retain=False, kind="event")
+            while self.connected and self._dirty:
+                with self._lock:
+                    key, _ = self._dirty.popitem()
+                    update = self._states[key]
+                payload = {"state": update.state, "score": round(update.score, 3), "ts": update.ts}
+                self._publish(f"{self.prefix}/state/{update.camera}/{update.zone}", payload, retain=True, kind="state")
+
+    def _publish(self, topic: str, payload: dict, retain: bool, kind: str) -> None:
+        # With QoS 1, paho keeps a message it could not write and sends it after reconnecting.
+        self.client.publish(topic, json.dumps(payload, separators=(",", ":")), qos=self.qos, retain=retain)
+        self.published[kind] += 1
@@ -0,0 +1,41 @@
+from .event_outbox import EventOutbox, OutboxEvent
+from .metrics import SEMANTIC_EVENTS
+from .mqtt_publisher import MqttPublisher
+from .pipeline import ZoneEvent, ZoneStateUpdate
+
+
+def emit_zone_event(events, camera_name: str, event: ZoneEvent) -> None:
+    # The one place a zone event becomes a Frigate event, for every runtime. events is the notifier,
+    # or in a worker process the queue the main process forwards to it.
+    SEMANTIC_EVENTS.labels(camera=camera_name, type=event.label).inc()
+    events.put(
+        OutboxEvent(
+            camera=camera_name,
+            label=event.label,
+            sub_label=f"{event.extra} conf={event.score:.2f} source=metis",
+            score=event.score,
+            duration=event.duration,
+        )
+    )
+
+
+class Notifier:
+    # Fans camera-worker output out to its consumers: zone events to the Frigate outbox and MQTT,
+    # zone states to MQTT. Worker processes put the same items on a multiprocessing queue that
+    # forward() drains in the main process.
+    def __init__(self, outbox: EventOutbox, mqtt: MqttPublisher | None = None) -> None:
+        self.outbox = outbox
+        self.mqtt = mqtt
+
+    def put(self, item: OutboxEvent | ZoneStateUpdate) -> None:
+        if isinstance(item, ZoneStateUpdate):
+            if self.mqtt is not None:
+                self.mqtt.publish_state(item)
+            return
+        self.outbox.put(item)
+        if self.mqtt is not None:
+            self.mqtt.publish_event(item)
+
+    def forward(self, queue) -> None:
+        while True:
+            self.put(queue.get())
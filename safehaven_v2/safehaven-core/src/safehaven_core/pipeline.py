@@ -0,0 +1,208 @@
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+
+from .change_gate import ZoneChangeGate
+from .config import AppConfig, CameraConfig
+from .frame_pool import FramePool
+from .mailbox import LatestMailbox
+from .metis_client import MetisClient, UdsMetisClient
+from .mosaic import MosaicTiler, Tile
+from .preprocess import Letterbox, ZonePreprocessor
+from .sampling import SamplingScheduler
+from .shm_ring import SharedFrameRing
+from .state_machines import DebouncedStateMachine, ZoneState
+
+
+@dataclass
+class CameraRuntime:
+    camera: CameraConfig
+    mailbox: LatestMailbox | SharedFrameRing
+    pool: FramePool | SharedFrameRing
+    machines: dict[str, DebouncedStateMachine] = field(default_factory=dict)
+    scheduler: SamplingScheduler | None = None
+
+
+@dataclass
+class ZoneEvent:
+    label: str
+    score: float
+    duration: int
+    extra: str
+
+
+@dataclass
+class ZoneStateUpdate:
+    camera: str
+    zone: str
+    state: str
+    score: float
+    ts: float
+
+
+@dataclass
+class FrameWork:
+    observations: dict[str, tuple[ZoneState, float]]
+    crops: dict[str, np.ndarray]
+    fingerprints: dict[str, np.ndarray]
+    pending: list[str]
+    tiles: list[Tile] | None = None
+
+
+def default_zone_class_ids() -> dict[str, dict[str, int]]:
+    return {
+        "garage": {"open": 0, "closed": 1},
+        "gate": {"open": 2, "closed": 3},
+        "latch": {"open": 4, "closed": 5},
+    }
+
+
+def jpg_bytes(frame: np.ndarray) -> bytes:
+    ok, encoded = cv2.imencode(".jpg", frame)
+    if not ok:
+        raise RuntimeError("Failed to JPEG encode frame")
+    return encoded.tobytes()
+
+
+def call_metis(
+    metis: MetisClient | UdsMetisClient,
+    roi_frames: list[np.ndarray],
+    letterboxes: list[Letterbox | None] | None = None,
+) -> list[list[list[float]]]:
+    if metis.raw_tensors:
+        return metis.detect_tensors(roi_frames, letterboxes)
+    return metis.detect_batch([jpg_bytes(roi_frame) for roi_frame in roi_frames], letterboxes=letterboxes)
+
+
+def zone_state_from_detections(
+    detections: list[list[float]],
+    class_ids: dict[str, int],
+    conf_threshold: float = 0.5,
+) -> tuple[ZoneState, float]:
+    best_open = 0.0
+    best_closed = 0.0
+    open_cls = class_ids["open"]
+    closed_cls = class_ids["closed"]
+    for det in detections:
+        if len(det) < 6:
+            continue
+        cls_id = int(det[0])
+        score = float(det[1])
+        if cls_id == open_cls:
+            best_open = max(best_open, score)
+        elif cls_id == closed_cls:
+            best_closed = max(best_closed, score)
+
+    if best_open < conf_threshold and best_closed < conf_threshold:
+        return ZoneState.UNKNOWN, 0.0
+    if best_open >= best_closed:
+        return ZoneState.OPEN, best_open
+    return ZoneState.CLOSED, best_closed
+
+
+class ZonePipeline:
+    # Per-frame zone logic shared by the thread, process and asyncio runtimes. The caller owns the
+    # I/O: start() picks due zones and consults the change gates, the caller sends inputs(work) to
+    # Metis and hands the results to observe(), and finish() updates the state machines.
+    def __init__(self, config: AppConfig, runtime: CameraRuntime) -> None:
+        self.camera = runtime.camera
+        self.machines = runtime.machines
+        self.scheduler = runtime.scheduler
+        self.left_open_minutes = config.left_open_minutes
+        self.class_map = default_zone_class_ids()
+        self.zones = [zone for zone in self.camera.rois if zone in self.machines and zone in self.class_map]
+        self.gates = {}
+        if config.change_threshold > 0:
+            self.gates = {
+                zone: ZoneChangeGate(self.camera.name, zone, config.change_threshold, config.change_max_age_s)
+                for zone in self.zones
+            }
+        self.preprocessor = ZonePreprocessor(self.camera.rois, self.camera.preprocess)
+        self.tiler = MosaicTiler(config.mosaic_size) if config.inference_layout == "mosaic" else None
+        self.state_heartbeat_s = config.mqtt_heartbeat_s if config.mqtt_broker else None
+        self._published: dict[str, tuple[ZoneState, float]] = {}
+
+    def start(self, frame: np.ndarray, now: float) -> FrameWork | None:
+        active = self.zones
+        if self.scheduler is not None:
+            due = self.scheduler.due_zones(now)
+            active = [zone for zone in self.zones if zone in due]
+            if not active:
+                return None
+
+        # Crops are views into the (pooled) frame; the caller releases it after inference.
+        work = FrameWork(
+            observations={zone: (ZoneState.UNKNOWN, 0.0) for zone in active},
+            crops={zone: self.preprocessor.crop(frame, zone) for zone in active},
+            fingerprints={},
+            pending=[],
+        )
+        for zone in active:
+            gate = self.gates.get(zone)
+            if gate is not None:
+                work.fingerprints[zone] = gate.fingerprint(work.crops[zone])
+                # A cached result must not count towards debouncing: while a transition is pending,
+                # every sample is inferred afresh.
+                cached = None
+                if self.machines[zone].pending_since() is None:
+                    cached = gate.lookup(work.fingerprints[zone], now)
+                if cached is not None:
+                    work.observations[zone] = cached
+                    continue
+            work.pending.append(zone)
+        return work
+
+    def inputs(self, work: FrameWork) -> tuple[list[np.ndarray], list[Letterbox | None]]:
+        # In mosaic layout, two or more pending zones go out as one image; otherwise each zone is
+        # preprocessed to the detector input, with letterbox geometry for the detector to undo.
+        crops = [work.crops[zone] for zone in work.pending]
+        if self.tiler is not None and len(crops) > 1:
+            work.tiles = self.tiler.layout(crops)
+            return [self.tiler.compose(work.tiles, crops)], [None]
+        prepared = [self.preprocessor.prepare(zone, work.crops[zone]) for zone in work.pending]
+        return [image for image, _ in prepared], [letterbox for _, letterbox in prepared]
+
+    def observe(self, work: FrameWork, results: list[list[list[float]]], now: float) -> None:
+        if work.tiles is not None:
+            results = self.tiler.split(work.tiles, results[0] if results else [])
+        for zone, detections in zip(work.pending, results):
+            work.observations[zone] = zone_state_from_detections(detections, self.class_map[zone])
+            if zone in self.gates:
+                self.gates[zone].store(work.fingerprints[zone], *work.observations[zone], now)
+
+    def finish(self, work: FrameWork, now: float) -> list[ZoneEvent]:
+        events = []
+        for zone, (observed, score) in work.observations.items():
+            out = self.machines[zone].update(observed, now)
+            if out.transition_event:
+                events.append(ZoneEvent(out.transition_event, score, 15, f"zone={zone} state={observed.value}"))
+            if out.left_open_event:
+                events.append(
+                    ZoneEvent(
+                        out.left_open_event,
+                        max(0.5, score),
+                        30,
+                        f"zone={zone} open_for={self.left_open_minutes}m",
+                    )
+                )
+            if self.scheduler is not None:
+                self.scheduler.mark(zone, now)
+
+        if self.scheduler is not None:
+            self.scheduler.refresh(now)
+        return events
+
+    def states(self, work: FrameWork, now: float) -> list[ZoneStateUpdate]:
+        # Debounced zone states for MQTT, reported only on change or once per heartbeat.
+        if self.state_heartbeat_s is None:
+            return []
+        updates = []
+        for zone, (_observed, score) in work.observations.items():
+            state = self.machines[zone].state
+            last = self._published.get(zone)
+            if last is not None and last[0] == state and now - last[1] < self.state_heartbeat_s:
+                continue
+            self._published[zone] = (state, now)
+            updates.append(ZoneStateUpdate(self.camera.name, zone, state.value, score, now))
+        return updates
@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+
+from .config import ROI, PreprocessConfig
+from .rtsp_sampler import roi_rect
+
+# Content region of a letterboxed image as fractions of it: (x0, y0, x1, y1).
+Letterbox = tuple[float, float, float, float]
+
+
+class ZonePreprocessor:
+    # Crop rectangles are computed once per frame shape. Zones with a preprocess size are resized
+    # ("resize") or letterboxed ("letterbox") straight to the detector input in a reused per-zone
+    # buffer; the letterbox padding is painted once, so each frame only writes the content region.
+    # Crops already within the input size are sent as they are.
+    def __init__(self, rois: dict[str, ROI], specs: dict[str, PreprocessConfig], pad: int = 114) -> None:
+        self.rois = rois
+        self.specs = {zone: spec for zone, spec in specs.items() if spec.size > 0}
+        self.pad = pad
+        self._rects: dict[tuple[int, int], dict[str, tuple[int, int, int, int]]] = {}
+        self._buffers: dict[str, tuple[tuple[int, int], np.ndarray, tuple[int, int, int, int], Letterbox | None]] = {}
+
+    def crop(self, frame: np.ndarray, zone: str) -> np.ndarray:
+        h, w = frame.shape[:2]
+        rects = self._rects.get((h, w))
+        if rects is None:
+            rects = self._rects[(h, w)] = {name: roi_rect(roi, w, h) for name, roi in self.rois.items()}
+        x1, y1, x2, y2 = rects[zone]
+        return frame[y1:y2, x1:x2]
+
+    def prepare(self, zone: str, crop: np.ndarray) -> tuple[np.ndarray, Letterbox | None]:
+        spec = self.specs.get(zone)
+        if spec is None:
+            return crop, None
+        crop_h, crop_w = crop.shape[:2]
+        if crop_w <= spec.size and crop_h <= spec.size:
+            return crop, None
+
+        cached = self._buffers.get(zone)
+        if cached is None or cached[0] != (crop_h, crop_w):
+            cached = self._buffers[zone] = self._geometry(spec, crop_h, crop_w, crop.shape[2:])
+        _shape, buf, (x, y, w, h), letterbox = cached
+        buf[y : y + h, x : x + w] = cv2.resize(crop, (w, h), interpolation=cv2.INTER_AREA)
+        return buf, letterbox
+
+    def _geometry(self, spec: PreprocessConfig, crop_h: int, crop_w: int, channels: tuple[int, ...]):
+        size = spec.size
+        buf = np.full((size, size, *channels), self.pad, dtype=np.uint8)
+        if spec.fit == "resize":
+            return (crop_h, crop_w), buf, (0, 0, size, size), None
+        scale = min(size / crop_w, size / crop_h)
+        w, h = max(1, round(crop_w * scale)), max(1, round(crop_h * scale))
+        x, y = (size - w) // 2, (size - h) // 2
+        return (crop_h, crop_w), buf, (x, y, w, h), (x / size, y / size, (x + w) / size, (y + h) / size)
@@ -1,10 +1,24 @@
+import itertools
+import json
+import logging
+import queue
+import subprocess
+import threading
 import time
+from collections.abc import Callable
 from dataclasses import dataclass
 
 import cv2
 import numpy as np
 
-from .config import ROI
+from .config import ROI, FfmpegConfig
+from .frame_pool import FramePool
+from .metrics import FRAME_AGE_MS
+
+LOGGER = logging.getLogger(__name__)
+
+# Delay before a sampler whose stream generator raised is started again.
+SAMPLER_RESTART_S = 1.0
 
 
 @dataclass
@@ -14,8 +28,7 @@ class Sample:
     captured_ts: float
 
 
-def crop_roi(frame: np.ndarray, roi: ROI) -> np.ndarray:
-    h, w = frame.shape[:2]
+def roi_rect(roi: ROI, w: int, h: int) -> tuple[int, int, int, int]:
     x1 = int(roi.x * w) if roi.x <= 1 else int(roi.x)
     y1 = int(roi.y * h) if roi.y <= 1 else int(roi.y)
     rw = int(roi.w * w) if roi.w <= 1 else int(roi.w)
@@ -24,13 +37,63 @@ def crop_roi(frame: np.ndarray, roi: ROI) -> np.ndarray:
     y2 = min(h, max(y1 + 1, y1 + rh))
     x1 = max(0, min(x1, w - 1))
     y1 = max(0, min(y1, h - 1))
-    return frame[y1:y2, x1:x2]
+    return x1, y1, x2, y2
+
+
+def sample_stream(
+    stream_url: str,
+    sample_fps: float,
+    mode: str = "read",
+    camera: str = "",
+    ffmpeg: FfmpegConfig | None = None,
+    fps_fn: Callable[[], float] | None = None,
+    pool: FramePool | None = None,
+    pace: bool = True,
+):
+    # fps_fn, when given, is polled for the current rate; sample_fps is then the ceiling
+    # (ffmpeg is started at sample_fps and surplus frames are dropped here).
+    # With a pool, frames are decoded into pooled buffers and the consumer must release them;
+    # a sample is skipped when the pool's budget is exhausted. Without one, the ffmpeg sampler
+    # rotates through FFMPEG_RING_BUFFERS buffers of its own, so a frame stays valid until
+    # FFMPEG_RING_BUFFERS - 1 further frames have been yielded.
+    # pace=False leaves the read sampler's pacing to the caller, so each next() is one read.
+    rate = fps_fn or (lambda: sample_fps)
+    if mode == "grab":
+        yield from _sample_stream_grab(stream_url, rate, camera, pool)
+        return
+    if mode == "ffmpeg":
+        yield from _sample_stream_ffmpeg(stream_url, sample_fps, fps_fn, ffmpeg or FfmpegConfig(), camera, pool)
+        return
+    yield from _sample_stream_read(stream_url, rate, pool, pace)
+
+
+def _interval(rate: Callable[[], float]) -> float:
+    return 1.0 / max(rate(), 0.1)
+
+
+def _capture_shape(cap) -> tuple[int, int, int] | None:
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if width <= 0 or height <= 0:
+        return None
+    return height, width, 3
 
 
-def sample_stream(stream_url: str, sample_fps: float):
-    interval = 1.0 / max(sample_fps, 0.1)
+def _pooled(pool: FramePool | None, shape: tuple[int, ...] | None, timeout: float = 0.0) -> np.ndarray | None:
+    if pool is None or shape is None:
+        return None
+    return pool.acquire(shape, timeout)
+
+
+def _release(pool: FramePool | None, frame: np.ndarray | None) -> None:
+    if pool is not None and frame is not None:
+        pool.release(frame)
+
+
+def _sample_stream_read(stream_url: str, rate: Callable[[], float], pool: FramePool | None, pace: bool = True):
     backoff = 1.0
     cap = None
+    shape = None
 
     while True:
         if cap is None or not cap.isOpened():
@@ -40,19 +103,246 @@ def sample_stream(stream_url: str, sample_fps: float):
                 backoff = min(10.0, backoff * 2)
                 continue
             backoff = 1.0
+            shape = _capture_shape(cap)
 
         start = time.time()
-        ok, frame = cap.read()
+        buf = _pooled(pool, shape, timeout=_interval(rate))
+        if pool is not None and shape is not None and buf is None:
+            # Pool exhausted: skip this sample without decoding it.
+            cap.grab()
+            continue
+        ok, frame = cap.read(buf)
+        if not ok or frame is None or frame is not buf:
+            # On failure, or when OpenCV reallocated for a new size, the pooled buffer is unused.
+            _release(pool, buf)
         if not ok or frame is None:
             cap.release()
             cap = None
             time.sleep(backoff)
             backoff = min(10.0, backoff * 2)
             continue
+        shape = frame.shape
 
         yield frame, start
 
+        if not pace:
+            continue
         elapsed = time.time() - start
-        sleep_time = interval - elapsed
+        sleep_time = _interval(rate) - elapsed
         if sleep_time > 0:
             time.sleep(sleep_time)
+
+
+def _offer_latest(slot: queue.Queue, item, pool: FramePool | None = None) -> None:
+    while True:
+        try:
+            slot.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                stale = slot.get_nowait()
+            except queue.Empty:
+                continue
+            if stale is not None:
+                _release(pool, stale[0])
+
+
+def _grab_loop(
+    cap,
+    rate: Callable[[], float],
+    slot: queue.Queue,
+    stop: threading.Event,
+    pool: FramePool | None,
+) -> None:
+    # grab() drains the stream without decoding; only the first frame past each deadline is
+    # retrieve()d, so OpenCV's buffer never backs up and decode cost follows sample_fps.
+    next_deadline = time.time()
+    shape = _capture_shape(cap)
+    try:
+        while not stop.is_set():
+            if not cap.grab():
+                break
+            grabbed_ts = time.time()
+            if grabbed_ts < next_deadline:
+                continue
+            interval = _interval(rate)
+            next_deadline += interval
+            if next_deadline <= grabbed_ts:
+                next_deadline = grabbed_ts + interval
+            buf = _pooled(pool, shape)
+            if pool is not None and shape is not None and buf is None:
+                continue
+            ok, frame = cap.retrieve(buf)
+            if not ok or frame is None or frame is not buf:
+                _release(pool, buf)
+            if not ok or frame is None:
+                break
+            shape = frame.shape
+            _offer_latest(slot, (frame, grabbed_ts), pool)
+    finally:
+        cap.release()
+        _offer_latest(slot, None, pool)
+
+
+def _sample_stream_grab(stream_url: str, rate: Callable[[], float], camera: str, pool: FramePool | None):
+    backoff = 1.0
+
+    while True:
+        cap = cv2.VideoCapture(stream_url)
+        if not cap.isOpened():
+            cap.release()
+            time.sleep(backoff)
+            backoff = min(10.0, backoff * 2)
+            continue
+        backoff = 1.0
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        slot: queue.Queue = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        threading.Thread(
+            target=_grab_loop,
+            args=(cap, rate, slot, stop, pool),
+            daemon=True,
+            name=f"grab-{camera}",
+        ).start()
+        try:
+            while True:
+                item = slot.get()
+                if item is None:
+                    break
+                frame, grabbed_ts = item
+                FRAME_AGE_MS.labels(camera=camera).observe((time.time() - grabbed_ts) * 1000.0)
+                yield frame, grabbed_ts
+        finally:
+            stop.set()
+
+        time.sleep(backoff)
+        backoff = min(10.0, backoff * 2)
+
+
+def _probe_size(stream_url: str, options: FfmpegConfig) -> tuple[int, int] | None:
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height", "-of", "json"]
+    if stream_url.startswith("rtsp://"):
+        cmd += ["-rtsp_transport", options.rtsp_transport]
+    try:
+        out = subprocess.run(cmd + [stream_url], capture_output=True, timeout=15, check=True).stdout
+        stream = json.loads(out)["streams"][0]
+        return int(stream["width"]), int(stream["height"])
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError, IndexError) as exc:
+        LOGGER.warning("ffprobe failed url=%s err=%s", stream_url, exc)
+        return None
+
+
+def _ffmpeg_command(
+    stream_url: str,
+    sample_fps: float,
+    options: FfmpegConfig,
+    source_size: tuple[int, int] | None,
+) -> tuple[list[str], tuple[int, int]] | None:
+    # fps, crop and scale run inside ffmpeg so only the pixels we need at the rate we need
+    # reach Python. The output size must be known up front to size the frame buffers.
+    filters = [f"fps={max(sample_fps, 0.1)}"]
+    out_w, out_h = options.width, options.height
+    if options.crop is not None or not (out_w and out_h):
+        if source_size is None:
+            return None
+        src_w, src_h = source_size
+        if options.crop is not None:
+            # Same clamping as the zone crops, so a crop ROI selects the same pixels as a zone ROI.
+            x1, y1, x2, y2 = roi_rect(options.crop, src_w, src_h)
+            src_w, src_h = x2 - x1, y2 - y1
+            filters.append(f"crop={src_w}:{src_h}:{x1}:{y1}")
+        if out_w and not out_h:
+            out_h = int(src_h * out_w / src_w)
+        elif out_h and not out_w:
+            out_w = int(src_w * out_h / src_h)
+        elif not out_w:
+            out_w, out_h = src_w, src_h
+    out_w, out_h = max(2, out_w - out_w % 2), max(2, out_h - out_h % 2)
+    filters.append(f"scale={out_w}:{out_h}")
+
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error"]
+    if stream_url.startswith("rtsp://"):
+        cmd += ["-rtsp_transport", options.rtsp_transport]
+    cmd += ["-i", stream_url, "-an", "-vf", ",".join(filters), "-pix_fmt", "bgr24", "-f", "rawvideo", "pipe:1"]
+    return cmd, (out_w, out_h)
+
+
+def _read_frame(stream, buf: np.ndarray) -> bool:
+    view = memoryview(buf).cast("B")
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+    return True
+
+
+FFMPEG_RING_BUFFERS = 3
+
+
+def _sample_stream_ffmpeg(
+    stream_url: str,
+    sample_fps: float,
+    fps_fn: Callable[[], float] | None,
+    options: FfmpegConfig,
+    camera: str,
+    pool: FramePool | None,
+):
+    backoff = 1.0
+    slack = 0.5 / max(sample_fps, 0.1)
+    needs_probe = options.crop is not None or not (options.width and options.height)
+
+    while True:
+        source_size = _probe_size(stream_url, options) if needs_probe else None
+        built = _ffmpeg_command(stream_url, sample_fps, options, source_size)
+        if built is None:
+            time.sleep(backoff)
+            backoff = min(10.0, backoff * 2)
+            continue
+        cmd, (out_w, out_h) = built
+        shape = (out_h, out_w, 3)
+        # The pipe is always read into `reader`; a frame is handed out by swapping in a spare
+        # buffer, so skipped frames (rate limit or exhausted pool) cost no allocation.
+        ring = None
+        if pool is None:
+            ring = itertools.cycle([np.empty(shape, dtype=np.uint8) for _ in range(FFMPEG_RING_BUFFERS)])
+        reader = _pooled(pool, shape, timeout=backoff) if ring is None else next(ring)
+        if reader is None:
+            time.sleep(backoff)
+            backoff = min(10.0, backoff * 2)
+            continue
+
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        except OSError as exc:
+            LOGGER.warning("ffmpeg start failed camera=%s err=%s", camera, exc)
+            _release(pool, reader)
+            time.sleep(backoff)
+            backoff = min(10.0, backoff * 2)
+            continue
+
+        next_deadline = 0.0
+        try:
+            while True:
+                if not _read_frame(proc.stdout, reader):
+                    break
+                backoff = 1.0
+                now = time.time()
+                if fps_fn is not None:
+                    if now + slack < next_deadline:
+                        continue
+                    next_deadline = max(next_deadline, now) + 1.0 / max(fps_fn(), 0.1)
+                spare = _pooled(pool, shape) if ring is None else next(ring)
+                if spare is None:
+                    continue
+                frame, reader = reader, spare
+                yield frame, now
+        finally:
+            proc.kill()
+            proc.wait()
+            _release(pool, reader)
+        LOGGER.warning("ffmpeg sampler exited camera=%s code=%s", camera, proc.returncode)
+        time.sleep(backoff)
+        backoff = min(10.0, backoff * 2)
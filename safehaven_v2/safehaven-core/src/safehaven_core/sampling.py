@@ -0,0 +1,77 @@
+import multiprocessing
+from dataclasses import dataclass
+from enum import Enum
+
+from .metrics import SAMPLE_FPS
+from .state_machines import DebouncedStateMachine, ZoneState
+
+
+class SamplingMode(str, Enum):
+    IDLE = "idle"
+    CONFIRM = "confirm"
+    OPEN = "open"
+    DEFAULT = "default"
+
+
+@dataclass
+class ZoneRates:
+    idle: float
+    confirm: float
+    open: float
+    confirm_seconds: float
+
+
+class SamplingScheduler:
+    # Drives one camera's sampler rate and each zone's inference cadence from its state machine:
+    # boost while a transition is being debounced, modest while OPEN, very low while stably CLOSED.
+    def __init__(
+        self,
+        camera: str,
+        machines: dict[str, DebouncedStateMachine],
+        rates: dict[str, ZoneRates],
+        default_fps: float,
+    ) -> None:
+        self.machines = machines
+        self.rates = rates
+        self.default_fps = default_fps
+        self.max_fps = max([default_fps] + [r.confirm for r in rates.values()])
+        # Shared memory so a sampler in the parent sees rates set by a camera worker process.
+        self._fps = multiprocessing.RawValue("d", self.max_fps)
+        self._next_due = {zone: 0.0 for zone in machines}
+        self._gauge = SAMPLE_FPS.labels(camera=camera)
+        self._gauge.set(self.fps)
+
+    @property
+    def fps(self) -> float:
+        return self._fps.value
+
+    def mode(self, zone: str, now: float) -> SamplingMode:
+        machine = self.machines[zone]
+        pending_since = machine.pending_since()
+        if pending_since is not None and now - pending_since < self.rates[zone].confirm_seconds:
+            return SamplingMode.CONFIRM
+        if machine.state == ZoneState.OPEN:
+            return SamplingMode.OPEN
+        if machine.state == ZoneState.CLOSED:
+            return SamplingMode.IDLE
+        return SamplingMode.DEFAULT
+
+    def zone_fps(self, zone: str, now: float) -> float:
+        mode = self.mode(zone, now)
+        if mode == SamplingMode.DEFAULT:
+            return self.default_fps
+        return getattr(self.rates[zone], mode.value)
+
+    def due_zones(self, now: float) -> list[str]:
+        # Half a sampler interval of slack so jitter in frame arrival does not skip a whole frame.
+        slack = 0.5 / max(self.fps, 0.01)
+        return [zone for zone, due in self._next_due.items() if due - now <= slack]
+
+    def mark(self, zone: str, now: float) -> None:
+        self._next_due[zone] = now + 1.0 / max(self.zone_fps(zone, now), 0.01)
+
+    def refresh(self, now: float) -> None:
+        fps = max((self.zone_fps(zone, now) for zone in self.machines), default=self.default_fps)
+        if fps != self.fps:
+            self._fps.value = fps
+            self._gauge.set(fps)
@@ -0,0 +1,189 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+_OVERWRITTEN, _EXPIRED, _CONSUMED = range(3)
+
+
+class SharedFrameRing:
+    # Per-camera frame handoff between a sampler in the parent process and a camera worker in a
+    # worker process. Frames live in slots of one multiprocessing.shared_memory segment; only
+    # (segment, slot, shape, ts) tuples cross the process boundary, never pixels.
+    #
+    # Parent side it is the sampler's frame pool (acquire/release) and mailbox (put); worker side
+    # it is the mailbox (get) and pool (release), with LatestMailbox's depth/max-age semantics.
+    # The segment is sized on the first frame and recreated if the frame shape changes.
+    def __init__(self, camera: str, depth: int, max_age_s: float, budget_bytes: int, ctx) -> None:
+        self.camera = camera
+        self.depth = max(1, depth)
+        self.max_age_s = max_age_s
+        self.budget_bytes = budget_bytes
+        # One slot being filled, `depth` queued, one being processed and one in transit.
+        self.slots = self.depth + 3
+        self.allocations = 0
+        self.reuses = 0
+        self.exhausted = 0
+        self._owner_pid = os.getpid()
+        self._ready = ctx.Queue()
+        self._freed = ctx.Queue()
+        # Written only by the worker process, read by the parent's metrics collector.
+        self._counters = ctx.RawArray("q", 3)
+        self._sent = 0
+        self._lock = threading.Lock()
+        # Parent-side state.
+        self._shm: shared_memory.SharedMemory | None = None
+        self._shape: tuple[int, ...] | None = None
+        self._slot_bytes = 0
+        self._slot_count = 0
+        self._views: list[np.ndarray] = []
+        self._free: list[int] = []
+        self._filling: dict[int, int] = {}
+        # Worker-side state.
+        self._held: deque[tuple[str, int, tuple[int, ...], float]] = deque()
+        self._attached: dict[str, shared_memory.SharedMemory] = {}
+        self._lent: dict[int, tuple[str, int]] = {}
+
+    @property
+    def overwritten(self) -> int:
+        return self._counters[_OVERWRITTEN]
+
+    @property
+    def expired(self) -> int:
+        return self._counters[_EXPIRED]
+
+    @property
+    def in_use_bytes(self) -> int:
+        return (self._slot_count - len(self._free)) * self._slot_bytes
+
+    def idle_bytes(self) -> int:
+        return len(self._free) * self._slot_bytes
+
+    def qsize(self) -> int:
+        return max(0, self._sent - sum(self._counters))
+
+    # Parent (sampler) side.
+
+    def acquire(self, shape: tuple[int, ...], timeout: float = 0.0) -> np.ndarray | None:
+        shape = tuple(int(dim) for dim in shape)
+        with self._lock:
+            if shape != self._shape:
+                self._allocate(shape)
+            self._drain_freed()
+            waiting = not self._free and timeout > 0
+        if waiting:
+            try:
+                freed = self._freed.get(timeout=timeout)
+            except queue.Empty:
+                freed = None
+        with self._lock:
+            if waiting and freed is not None:
+                self._give_back(*freed)
+            if not self._free:
+                self.exhausted += 1
+                return None
+            slot = self._free.pop()
+            self.reuses += 1
+            view = self._views[slot]
+            self._filling[id(view)] = slot
+            return view
+
+    def put(self, frame: np.ndarray, ts: float) -> None:
+        with self._lock:
+            slot = self._filling.pop(id(frame), None)
+            if slot is None:
+                # Not a ring buffer (OpenCV reallocated for a new size); the next frame will be.
+                return
+            self._ready.put((self._shm.name, slot, self._shape, ts))
+            self._sent += 1
+
+    def close(self) -> None:
+        if self._shm is not None and os.getpid() == self._owner_pid:
+            self._shm.unlink()
+            self._shm = None
+
+    def _allocate(self, shape: tuple[int, ...]) -> None:
+        # In-flight slots of the old segment are ignored when they come back.
+        self.close()
+        self._slot_bytes = int(np.prod(shape))
+        self._slot_count = max(2, min(self.slots, self.budget_bytes // self._slot_bytes))
+        self._shm = shared_memory.SharedMemory(create=True, size=self._slot_count * self._slot_bytes)
+        buf = np.ndarray((self._slot_count, *shape), dtype=np.uint8, buffer=self._shm.buf)
+        self._views = list(buf)
+        self._free = list(range(self._slot_count))
+        self._filling.clear()
+        self._shape = shape
+        self.allocations += 1
+        LOGGER.info(
+            "Shared frame ring camera=%s segment=%s slots=%s shape=%s",
+            self.camera,
+            self._shm.name,
+            self._slot_count,
+            shape,
+        )
+
+    def _drain_freed(self) -> None:
+        while True:
+            try:
+                self._give_back(*self._freed.get_nowait())
+            except queue.Empty:
+                return
+
+    def _give_back(self, name: str, slot: int) -> None:
+        if self._shm is not None and name == self._shm.name:
+            self._free.append(slot)
+
+    # Worker side.
+
+    def get(self) -> tuple[np.ndarray, float]:
+        while True:
+            if not self._held:
+                self._held.append(self._ready.get())
+            while True:
+                try:
+                    self._held.append(self._ready.get_nowait())
+                except queue.Empty:
+                    break
+            while len(self._held) > self.depth:
+                name, slot, _shape, _ts = self._held.popleft()
+                self._counters[_OVERWRITTEN] += 1
+                self._freed.put((name, slot))
+            name, slot, shape, ts = self._held.popleft()
+            if self.max_age_s > 0 and time.time() - ts > self.max_age_s:
+                self._counters[_EXPIRED] += 1
+                self._freed.put((name, slot))
+                continue
+            self._counters[_CONSUMED] += 1
+            view = self._view(name, slot, shape)
+            self._lent[id(view)] = (name, slot)
+            return view, ts
+
+    def release(self, frame: np.ndarray) -> None:
+        if os.getpid() == self._owner_pid:
+            with self._lock:
+                slot = self._filling.pop(id(frame), None)
+                if slot is not None:
+                    self._free.append(slot)
+            return
+        lent = self._lent.pop(id(frame), None)
+        if lent is not None:
+            self._freed.put(lent)
+
+    def _view(self, name: str, slot: int, shape: tuple[int, ...]) -> np.ndarray:
+        shm = self._attached.get(name)
+        if shm is None:
+            for old in list(self._attached):
+                try:
+                    self._attached.pop(old).close()
+                except BufferError:
+                    pass
+            shm = self._attached[name] = shared_memory.SharedMemory(name=name)
+        nbytes = int(np.prod(shape))
+        return np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * nbytes)
@@ -40,6 +40,7 @@ class DebouncedStateMachine:
         self.state = ZoneState.UNKNOWN
         self._candidate: ZoneState | None = None
         self._candidate_count = 0
+        self._candidate_since: float | None = None
         self._open_since: float | None = None
         self._left_open_emitted = False
 
@@ -53,6 +54,7 @@ class DebouncedStateMachine:
             else:
                 self._candidate = ZoneState.UNKNOWN
                 self._candidate_count = 1
+                self._candidate_since = ts
             return StateOutput(None, self._check_left_open(ts))
 
         if self._candidate == observed:
@@ -60,6 +62,7 @@ class DebouncedStateMachine:
         else:
             self._candidate = observed
             self._candidate_count = 1
+            self._candidate_since = ts
 
         required = self.open_required if observed == ZoneState.OPEN else self.closed_required
         if self._candidate_count >= required and self.state != observed:
@@ -76,6 +79,12 @@ class DebouncedStateMachine:
         left_open_event = self._check_left_open(ts)
         return StateOutput(transition_event, left_open_event)
 
+    def pending_since(self) -> float | None:
+        # Start time of a not-yet-debounced OPEN/CLOSED candidate, if one is in progress.
+        if self._candidate in (ZoneState.OPEN, ZoneState.CLOSED) and self._candidate != self.state:
+            return self._candidate_since
+        return None
+
     def _check_left_open(self, ts: float) -> str | None:
         if self.state != ZoneState.OPEN:
             return None
@@ -0,0 +1,15 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def wait_until():
+    # Polls until predicate() is true, for state changed by another thread.
+    def wait(predicate, timeout: float = 2.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.01)
+
+    return wait
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import time
+from dataclasses import asdict
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from safehaven_core import event_outbox
+from safehaven_core.event_outbox import AsyncEventOutbox, EventOutbox, OutboxEvent
+
+
+class FakeFrigate:
+    # Answers Create Event calls from a script of statuses or exceptions; once the script runs out
+    # every call succeeds.
+    def __init__(self, *script) -> None:
+        self.script = list(script)
+        self.calls = []
+
+    def create_event(self, camera, label, sub_label, score=None, duration=None):
+        self.calls.append(label)
+        outcome = self.script.pop(0) if self.script else 200
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(status_code=outcome, text="")
+
+
+class AsyncFakeFrigate(FakeFrigate):
+    async def create_event(self, *args, **kwargs):
+        return super().create_event(*args, **kwargs)
+
+
+def spool_records(path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(event_outbox, "BACKOFF_S", 0.01)
+
+
+def test_delivers_and_acks_in_the_spool(tmp_path, wait_until):
+    spool = tmp_path / "outbox.jsonl"
+    outbox = EventOutbox(FakeFrigate(), str(spool))
+    outbox.start()
+    outbox.put(OutboxEvent("front", "garage_opened", "zone=garage", 0.9, 15))
+    wait_until(lambda: spool_records(spool)[-1:] == [{"ack": 1}])
+    assert outbox.delivered == 1
+    assert outbox.depth() == 0
+
+
+@pytest.mark.parametrize(
+    "failure",
+    [503, 429, requests.ConnectionError("refused"), TypeError("unexpected")],
+)
+def test_retries_transient_failures(tmp_path, failure, wait_until):
+    frigate = FakeFrigate(failure, failure)
+    outbox = EventOutbox(frigate, str(tmp_path / "outbox.jsonl"))
+    outbox.start()
+    outbox.put(OutboxEvent("front", "garage_opened", ""))
+    wait_until(lambda: outbox.delivered == 1)
+    assert frigate.calls == ["garage_opened"] * 3
+    assert outbox.failures["error"] == 2
+    assert outbox._in_flight == 0
+
+
+def test_drops_rejected_events(tmp_path, wait_until):
+    frigate = FakeFrigate(400)
+    outbox = EventOutbox(frigate, str(tmp_path / "outbox.jsonl"))
+    outbox.start()
+    outbox.put(OutboxEvent("front", "garage_opened", ""))
+    wait_until(lambda: outbox.depth() == 0)
+    assert outbox.failures["rejected"] == 1
+    assert frigate.calls == ["garage_opened"]
+
+
+def test_drops_expired_events(tmp_path, wait_until):
+    frigate = FakeFrigate()
+    outbox = EventOutbox(frigate, str(tmp_path / "outbox.jsonl"), max_age_s=60)
+    outbox.start()
+    outbox.put(OutboxEvent("front", "garage_opened", "", created=time.time() - 120))
+    wait_until(lambda: outbox.failures["expired"] == 1)
+    assert frigate.calls == []
+
+
+def test_replays_undelivered_events_after_restart(tmp_path, wait_until):
+    spool = tmp_path / "outbox.jsonl"
+    lines = [
+        asdict(OutboxEvent("front", "delivered", "", id=1)),
+        asdict(OutboxEvent("front", "pending", "", id=2)),
+        {"ack": 1},
+    ]
+    spool.write_text("".join(json.dumps(line) + "\n" for line in lines) + '{"camera": "fr')
+
+    frigate = FakeFrigate()
+    outbox = EventOutbox(frigate, str(spool))
+    outbox.start()
+    wait_until(lambda: outbox.delivered == 1)
+    assert frigate.calls == ["pending"]
+
+    outbox.put(OutboxEvent("front", "next", ""))
+    wait_until(lambda: outbox.delivered == 2)
+    assert [record.get("id") for record in spool_records(spool) if "ack" not in record] == [2, 3]
+
+
+@pytest.mark.parametrize(
+    "record",
+    [{"camera": "front", "label": "missing_fields"}, {"unknown": 1}, [1, 2], "text", {"ack": [1]}],
+)
+def test_replay_skips_malformed_records(tmp_path, wait_until, record):
+    spool = tmp_path / "outbox.jsonl"
+    lines = [record, asdict(OutboxEvent("front", "pending", "", id=2))]
+    spool.write_text("".join(json.dumps(line) + "\n" for line in lines))
+
+    frigate = FakeFrigate()
+    outbox = EventOutbox(frigate, str(spool))
+    outbox.start()
+    wait_until(lambda: outbox.delivered == 1)
+    assert frigate.calls == ["pending"]
+
+
+def test_async_outbox_retries_on_the_loop(tmp_path):
+    frigate = AsyncFakeFrigate(503)
+    outbox = AsyncEventOutbox(str(tmp_path / "outbox.jsonl"))
+
+    async def scenario() -> None:
+        runner = asyncio.create_task(outbox.run(frigate))
+        await asyncio.sleep(0)
+        outbox.put(OutboxEvent("front", "garage_opened", ""))
+        for _ in range(200):
+            if outbox.delivered:
+                break
+            await asyncio.sleep(0.01)
+        runner.cancel()
+
+    asyncio.run(scenario())
+    assert outbox.delivered == 1
+    assert outbox.failures["error"] == 1
+    assert frigate.calls == ["garage_opened"] * 2
@@ -0,0 +1,58 @@
+import threading
+
+import numpy as np
+
+from safehaven_core.frame_pool import FramePool
+
+
+def test_released_buffers_are_reused():
+    pool = FramePool(budget_bytes=1000)
+    buf = pool.acquire((10, 10, 3))
+    assert buf.shape == (10, 10, 3) and buf.dtype == np.uint8
+    assert pool.in_use_bytes == 300
+    pool.release(buf)
+    assert pool.in_use_bytes == 0
+    assert pool.idle_bytes() == 300
+    assert pool.acquire((10, 10, 3)) is buf
+    assert (pool.allocations, pool.reuses) == (1, 1)
+
+
+def test_returns_none_when_the_budget_is_exhausted():
+    pool = FramePool(budget_bytes=600)
+    first = pool.acquire((10, 10, 3))
+    second = pool.acquire((10, 10, 3))
+    assert first is not None and second is not None
+    assert pool.acquire((10, 10, 3)) is None
+    assert pool.exhausted == 1
+    assert pool.allocated_bytes == 600
+
+
+def test_acquire_waits_for_a_release():
+    pool = FramePool(budget_bytes=300)
+    buf = pool.acquire((10, 10, 3))
+    threading.Timer(0.05, pool.release, args=(buf,)).start()
+    assert pool.acquire((10, 10, 3), timeout=2.0) is buf
+    assert pool.exhausted == 0
+
+
+def test_idle_buffers_of_other_shapes_are_freed_for_a_new_shape():
+    pool = FramePool(budget_bytes=400)
+    pool.release(pool.acquire((10, 10, 3)))
+    buf = pool.acquire((20, 20))
+    assert buf is not None
+    assert pool.allocated_bytes == 400
+    assert pool.allocations == 2
+
+
+def test_a_budget_smaller_than_one_frame_still_allows_one_buffer():
+    pool = FramePool(budget_bytes=10)
+    buf = pool.acquire((10, 10, 3))
+    assert buf is not None
+    assert pool.acquire((10, 10, 3)) is None
+
+
+def test_foreign_arrays_are_ignored_on_release():
+    pool = FramePool(budget_bytes=1000)
+    pool.release(np.zeros((10, 10, 3), dtype=np.uint8))
+    assert pool.idle_bytes() == 0
+    assert pool.in_use_bytes == 0
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from safehaven_core.mailbox import AsyncLatestMailbox, LatestMailbox
+
+
+def frame(value: int) -> np.ndarray:
+    return np.full((2, 2), value, dtype=np.uint8)
+
+
+def test_keeps_only_the_latest_frames_and_releases_the_rest():
+    released = []
+    mailbox = LatestMailbox(depth=2, release=released.append)
+    for value in range(4):
+        mailbox.put(frame(value), time.time())
+    assert mailbox.qsize() == 2
+    assert mailbox.overwritten == 2
+    assert [int(item[0, 0]) for item in released] == [0, 1]
+    assert int(mailbox.get()[0][0, 0]) == 2
+    assert int(mailbox.get()[0][0, 0]) == 3
+
+
+def test_get_skips_stale_frames():
+    released = []
+    mailbox = LatestMailbox(depth=2, max_age_s=1.0, release=released.append)
+    mailbox.put(frame(0), time.time() - 5)
+    mailbox.put(frame(1), time.time())
+    item, _ts = mailbox.get()
+    assert int(item[0, 0]) == 1
+    assert mailbox.expired == 1
+    assert [int(item[0, 0]) for item in released] == [0]
+
+
+def test_get_blocks_until_a_frame_arrives():
+    mailbox = LatestMailbox()
+    got = []
+    consumer = threading.Thread(target=lambda: got.append(mailbox.get()))
+    consumer.start()
+    time.sleep(0.05)
+    assert got == []
+    mailbox.put(frame(7), 1.0)
+    consumer.join(timeout=2)
+    assert int(got[0][0][0, 0]) == 7
+    assert got[0][1] == 1.0
+
+
+def test_async_mailbox_waits_on_the_loop():
+    mailbox = AsyncLatestMailbox(depth=1)
+
+    async def scenario() -> tuple[np.ndarray, float]:
+        getter = asyncio.create_task(mailbox.get())
+        await asyncio.sleep(0)
+        mailbox.put(frame(1), time.time())
+        mailbox.put(frame(2), time.time())
+        return await asyncio.wait_for(getter, 2)
+
+    item, _ts = asyncio.run(scenario())
+    assert int(item[0, 0]) == 2
+    assert mailbox.overwritten == 1
@@ -0,0 +1,53 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from safehaven_core.metis_client import MetisBusyError, MetisClient
+
+
+@pytest.fixture
+def stalled_detector():
+    # A detector that holds every request until the test releases it.
+    release = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            release.wait(5)
+            body = b"[]"
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/detect", release
+    release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def test_waiting_for_a_pooled_connection_is_bounded(stalled_detector):
+    url, release = stalled_detector
+    client = MetisClient(url, pool_size=1, timeout=3.0, connect_timeout=0.5, transport="jpeg")
+    client.session.get_adapter(url).pool_timeout = 0.2
+    client.session.get_adapter(url).init_poolmanager(1, 1, block=True)
+    holder = threading.Thread(target=client.detect, args=(b"jpeg",))
+    holder.start()
+    time.sleep(0.1)
+
+    started = time.monotonic()
+    with pytest.raises(MetisBusyError):
+        client.detect(b"jpeg")
+    assert time.monotonic() - started < 2.0
+
+    release.set()
+    holder.join(timeout=5)
+    assert client.detect(b"jpeg") == []
@@ -0,0 +1,167 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from safehaven_core.config import load_config
+from safehaven_core.event_outbox import OutboxEvent
+from safehaven_core.mqtt_publisher import MqttPublisher, parse_broker
+from safehaven_core.pipeline import CameraRuntime, ZonePipeline, ZoneStateUpdate
+from safehaven_core.state_machines import DebouncedStateMachine
+
+ACCEPTED = SimpleNamespace(is_failure=False)
+
+
+class FakeClient:
+    # Records what MqttPublisher asks of paho's Client; the test plays the broker by calling the
+    # connect and disconnect callbacks itself.
+    def __init__(self) -> None:
+        self.will = None
+        self.published = []
+        self.on_connect = None
+        self.on_disconnect = None
+
+    def will_set(self, topic, payload, qos=0, retain=False) -> None:
+        self.will = (topic, payload, qos, retain)
+
+    def reconnect_delay_set(self, min_delay, max_delay) -> None:
+        pass
+
+    def connect_async(self, host, port, keepalive) -> None:
+        pass
+
+    def loop_start(self) -> None:
+        pass
+
+    def publish(self, topic, payload, qos=0, retain=False) -> None:
+        self.published.append((topic, payload, qos, retain))
+
+    def connect(self) -> None:
+        self.on_connect(self, None, None, ACCEPTED, None)
+
+    def disconnect(self) -> None:
+        self.on_disconnect(self, None, None, ACCEPTED, None)
+
+
+def state_messages(client: FakeClient) -> list[tuple[str, dict, bool]]:
+    return [
+        (topic, json.loads(payload), retain)
+        for topic, payload, _qos, retain in client.published
+        if "/state/" in topic
+    ]
+
+
+@pytest.fixture
+def publisher():
+    client = FakeClient()
+    publisher = MqttPublisher(client, prefix="sh/")
+    publisher.start("broker")
+    return client, publisher
+
+
+def test_last_will_and_online_status(publisher):
+    client, publisher = publisher
+    assert client.will == ("sh/status", "offline", 1, True)
+    assert client.published == []
+
+    client.connect()
+    assert client.published[0] == ("sh/status", "online", 1, True)
+    assert publisher.connected
+
+
+def test_states_are_retained_and_coalesced_while_disconnected(publisher, wait_until):
+    client, publisher = publisher
+    publisher.publish_state(ZoneStateUpdate("front", "garage", "closed", 0.9, 1.0))
+    publisher.publish_state(ZoneStateUpdate("front", "garage", "open", 0.8, 2.0))
+    publisher.publish_state(ZoneStateUpdate("front", "gate", "closed", 0.7, 2.0))
+    assert publisher.depth() == 2
+
+    client.connect()
+    wait_until(lambda: publisher.depth() == 0)
+    assert sorted(state_messages(client)) == [
+        ("sh/state/front/garage", {"state": "open", "score": 0.8, "ts": 2.0}, True),
+        ("sh/state/front/gate", {"state": "closed", "score": 0.7, "ts": 2.0}, True),
+    ]
+    assert publisher.published["state"] == 2
+
+
+def test_events_are_not_retained(publisher, wait_until):
+    client, publisher = publisher
+    client.connect()
+    publisher.publish_event(OutboxEvent("front", "garage_opened", "zone=garage", 0.9, 15, created=5.0, id=7))
+    wait_until(lambda: publisher.published["event"] == 1)
+    topic, payload, _qos, retain = client.published[-1]
+    assert topic == "sh/events/semantic"
+    assert not retain
+    assert json.loads(payload) == {
+        "camera": "front",
+        "label": "garage_opened",
+        "sub_label": "zone=garage",
+        "score": 0.9,
+        "duration": 15,
+        "created": 5.0,
+    }
+
+
+def test_all_states_are_sent_again_after_reconnect(publisher, wait_until):
+    client, publisher = publisher
+    client.connect()
+    publisher.publish_state(ZoneStateUpdate("front", "garage", "open", 0.8, 1.0))
+    publisher.publish_state(ZoneStateUpdate("back", "gate", "closed", 0.7, 1.0))
+    wait_until(lambda: publisher.published["state"] == 2)
+
+    client.disconnect()
+    assert not publisher.connected
+    publisher.publish_state(ZoneStateUpdate("front", "garage", "closed", 0.9, 2.0))
+    client.published.clear()
+
+    client.connect()
+    wait_until(lambda: publisher.published["state"] == 4)
+    assert client.published[0] == ("sh/status", "online", 1, True)
+    assert sorted(state_messages(client)) == [
+        ("sh/state/back/gate", {"state": "closed", "score": 0.7, "ts": 1.0}, True),
+        ("sh/state/front/garage", {"state": "closed", "score": 0.9, "ts": 2.0}, True),
+    ]
+
+
+def test_oldest_events_are_dropped_when_the_queue_is_full():
+    publisher = MqttPublisher(FakeClient(), queue_max=2)
+    for index in range(3):
+        publisher.publish_event(OutboxEvent("front", f"e{index}", ""))
+    assert publisher.dropped == 1
+    assert [event.label for event in publisher._events] == ["e1", "e2"]
+
+
+@pytest.mark.parametrize(
+    "broker, expected",
+    [("mosquitto", ("mosquitto", 1883)), ("mqtt://10.0.0.2:1884/", ("10.0.0.2", 1884))],
+)
+def test_parse_broker(broker, expected):
+    assert parse_broker(broker) == expected
+
+
+def test_pipeline_reports_states_on_change_and_heartbeat(monkeypatch):
+    monkeypatch.setenv("SAFEHAVEN_CONFIG", "/nonexistent")
+    monkeypatch.setenv("MQTT_BROKER", "mosquitto")
+    monkeypatch.setenv("MQTT_HEARTBEAT_S", "60")
+    monkeypatch.setenv("CHANGE_THRESHOLD", "0")
+    monkeypatch.setenv("CAMERAS", json.dumps([{"name": "front", "stream_url": "", "rois": {"garage": {}}}]))
+    config = load_config()
+    machine = DebouncedStateMachine("garage", "open", "closed", "opened", "closed", "left_open", 420)
+    runtime = CameraRuntime(camera=config.cameras[0], mailbox=None, pool=None, machines={"garage": machine})
+    pipeline = ZonePipeline(config, runtime)
+    frame = np.zeros((32, 32, 3), dtype=np.uint8)
+    opened = [[0, 0.9, 0.1, 0.1, 0.5, 0.5]]
+
+    def step(now: float) -> list[str]:
+        work = pipeline.start(frame, now)
+        pipeline.observe(work, [opened], now)
+        pipeline.finish(work, now)
+        return [update.state for update in pipeline.states(work, now)]
+
+    assert step(0.0) == ["unknown"]
+    assert step(1.0) == []
+    assert step(2.0) == ["open"]
+    assert step(30.0) == []
+    assert step(62.0) == ["open"]